@@ -1,28 +1,33 @@
 import os
+import sys
 import tempfile
 from typing import List
 from dotenv import load_dotenv
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, File, Form, UploadFile, HTTPException
 import fitz  # PyMuPDF
 import google.generativeai as genai
-from supabase import create_client, Client
+
+# Share the vector store implementations with the backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+from filters import parse_tags
+from vector_store import DEFAULT_COLLECTION, store_from_env
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase and Gemini
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+# Initialize Gemini and the vector store (VECTOR_STORE, default supabase)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-if not all([SUPABASE_URL, SUPABASE_SERVICE_KEY, GEMINI_API_KEY]):
+if not GEMINI_API_KEY:
     raise ValueError("Missing required environment variables. Please check your .env file.")
 
 genai.configure(api_key=GEMINI_API_KEY)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
 # Constants
 GEMINI_EMBED_MODEL = "models/text-embedding-004"
+EMBED_DIM = 768
+
+store = store_from_env(EMBED_DIM)
 
 # Create router
 router = APIRouter()
@@ -40,8 +45,16 @@ def embed(text: str, task: str) -> List[float]:
     )["embedding"]
 
 @router.post("/upload")
-async def upload_pdfs(pdfs: List[UploadFile] = File(...)):
+async def upload_pdfs(
+    pdfs: List[UploadFile] = File(...),
+    collection: str = Form(DEFAULT_COLLECTION),
+    tags: str = Form(""),
+):
     """Upload and process PDF files, extracting text and creating embeddings."""
+    try:
+        tag_list = parse_tags(tags)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     results = []
     
     for pdf in pdfs:
@@ -56,10 +69,12 @@ async def upload_pdfs(pdfs: List[UploadFile] = File(...)):
             payload = {
                 "filename": pdf.filename,
                 "content": text,
-                "embedding": vector  # JSON list → vector column
+                "embedding": vector,  # JSON list → vector column
+                "collection": collection or DEFAULT_COLLECTION,
+                "tags": tag_list
             }
             
-            result = supabase.table("documents").insert(payload).execute()
+            store.insert(payload)
             
             results.append({
                 "filename": pdf.filename,
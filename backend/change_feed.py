@@ -0,0 +1,91 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from local_index import latest_timestamp, parse_timestamp
+
+# Re-read this many seconds before the watermark on every poll: rows whose
+# transaction committed late carry an earlier updated_at than rows already
+# seen. Replaying them is harmless because applying a change is idempotent.
+DEFAULT_OVERLAP = 5.0
+
+
+def shift_timestamp(value: str, seconds: float) -> str:
+    return datetime.fromtimestamp(parse_timestamp(value) + seconds, tz=timezone.utc).isoformat()
+
+
+def latest_tombstone(supabase) -> Optional[str]:
+    """deleted_at of the newest tombstone, or None if there are none."""
+    rows = supabase.table("document_tombstones") \
+        .select("deleted_at") \
+        .order("deleted_at", desc=True) \
+        .limit(1) \
+        .execute() \
+        .data or []
+    return rows[0]["deleted_at"] if rows else None
+
+
+def fetch_changes(
+    supabase,
+    watermark: Optional[str],
+    columns: str,
+    page_size: int = 1000,
+    max_rows: int = 5000,
+    overlap: float = DEFAULT_OVERLAP,
+) -> Optional[dict]:
+    """
+    Rows changed and ids deleted since `watermark`, read from `documents`
+    (updated_at) and `document_tombstones` (deleted_at). Returns None when
+    more than `max_rows` rows changed, in which case a full reload is cheaper.
+
+    Result keys: upserts, deleted_ids, truncated_at (latest TRUNCATE seen, or
+    None) and watermark (the latest change timestamp seen).
+    """
+    since = shift_timestamp(watermark, -overlap) if watermark else None
+
+    # keyset paging on (updated_at, id): with offsets, a row deleted between
+    # pages would shift a later one into the previous page and skip it
+    upserts: List[dict] = []
+    while True:
+        select = supabase.table("documents") \
+            .select(columns) \
+            .order("updated_at") \
+            .order("id") \
+            .limit(page_size)
+        if upserts:
+            last = upserts[-1]
+            select = select.or_(
+                f'updated_at.gt."{last["updated_at"]}",'
+                f'and(updated_at.eq."{last["updated_at"]}",id.gt."{last["id"]}")'
+            )
+        elif since:
+            select = select.gte("updated_at", since)
+        page = select.execute().data or []
+        upserts.extend(page)
+        if len(upserts) > max_rows:
+            return None
+        if len(page) < page_size:
+            break
+
+    select = supabase.table("document_tombstones").select("document_id, deleted_at").order("deleted_at")
+    if since:
+        select = select.gte("deleted_at", since)
+    tombstones = select.execute().data or []
+
+    # a TRUNCATE tombstone has no document_id; anything before it is gone
+    truncated_at = latest_timestamp(*(t["deleted_at"] for t in tombstones if t["document_id"] is None))
+    if truncated_at:
+        cutoff = parse_timestamp(truncated_at)
+        upserts = [u for u in upserts if parse_timestamp(u.get("updated_at")) > cutoff]
+        tombstones = [t for t in tombstones if parse_timestamp(t["deleted_at"]) > cutoff]
+
+    return {
+        "upserts":      upserts,
+        "deleted_ids":  [t["document_id"] for t in tombstones if t["document_id"] is not None],
+        "truncated_at": truncated_at,
+        "watermark":    latest_timestamp(
+            watermark,
+            *(u.get("updated_at") for u in upserts),
+            *(t["deleted_at"] for t in tombstones),
+            truncated_at,
+        ),
+    }
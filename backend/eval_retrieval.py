@@ -0,0 +1,168 @@
+"""
+Offline recall-vs-latency evaluation of the retrieval backends.
+
+    python eval_retrieval.py [--docs 20000] [--queries 200] [--k 10]
+    python eval_retrieval.py --snapshot ./snap [--query-embeddings q.npy]
+    python eval_retrieval.py --backends exact,int8,prefix256,rpc --snapshot ./snap
+
+Ground truth is an exact brute-force cosine scan. For every backend the
+harness reports recall@k, MRR of the true nearest neighbour, per-query
+latency percentiles, build time and resident index size.
+
+Backends are comma-separated names:
+    exact                local float32 scan (what the fallback does)
+    int8, binary         quantized shortlist + exact rescoring
+    prefixN              first pass over the first N dims, e.g. prefix256
+    shardedN             exact scan split across N worker processes
+    int8+prefixN, ...    quantized prefix first pass
+    rpc                  Supabase match_documents; needs --snapshot of the
+                         same table, plus SUPABASE_URL / SUPABASE_SERVICE_KEY
+"""
+import re
+import json
+import time
+import argparse
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from local_index import LocalIndex, normalize_rows
+from quantization import synthetic_corpus
+
+DEFAULT_BACKENDS = "exact,int8,binary,prefix256,prefix128,int8+prefix256"
+
+
+# ───────────────────────  corpus / queries  ───────────────── #
+def synthetic(n_docs: int, n_queries: int, dim: int, seed: int) -> Tuple[List[dict], np.ndarray, np.ndarray]:
+    """
+    Clustered synthetic corpus. Dimension i is scaled by 1/sqrt(i + 1) so the
+    leading dimensions carry most of the signal, as in Matryoshka-trained
+    embeddings; without that, prefix search would look unrealistically bad.
+    """
+    rng    = np.random.default_rng(seed)
+    data   = synthetic_corpus(n_docs + n_queries, dim, 64, rng)
+    data  *= 1.0 / np.sqrt(np.arange(1, dim + 1, dtype=np.float32))
+    data   = normalize_rows(data)
+    rows   = [{"id": i, "filename": f"doc-{i}", "content": ""} for i in range(n_docs)]
+    return rows, data[n_queries:], data[:n_queries]
+
+
+def from_snapshot(path: str, query_path: Optional[str], n_queries: int, seed: int):
+    """
+    Corpus from a snapshot. Without a query file, queries are random corpus
+    rows plus noise, so their nearest neighbour is usually (not always) the
+    row they came from.
+    """
+    from snapshot import read_snapshot
+
+    rows, matrix = read_snapshot(path)
+    matrix = normalize_rows(np.asarray(matrix, dtype=np.float32))
+    if query_path:
+        return rows, matrix, normalize_rows(np.load(query_path).astype(np.float32))
+
+    rng   = np.random.default_rng(seed)
+    picks = rng.choice(len(matrix), size=min(n_queries, len(matrix)), replace=False)
+    noise = 0.3 * rng.standard_normal((len(picks), matrix.shape[1])).astype(np.float32) / np.sqrt(matrix.shape[1])
+    return rows, matrix, normalize_rows(matrix[picks] + noise)
+
+
+# ─────────────────────────  backends  ─────────────────────── #
+def local_backend(name: str) -> Dict[str, object]:
+    options: Dict[str, object] = {}
+    for part in name.split("+"):
+        prefix = re.fullmatch(r"prefix(\d+)", part)
+        sharded = re.fullmatch(r"sharded(\d+)", part)
+        if prefix:
+            options["prefix_dim"] = int(prefix.group(1))
+        elif sharded:
+            options["workers"] = int(sharded.group(1))
+        elif part in ("int8", "binary"):
+            options["quantization"] = part
+        elif part != "exact":
+            raise ValueError(f"Unknown backend component {part!r}")
+    return options
+
+
+def build_backend(name: str, rows: List[dict], matrix: np.ndarray) -> Tuple[Callable[[np.ndarray, int], List[dict]], Optional[int]]:
+    """Return (search(q_vec, k) -> rows, resident bytes or None)."""
+    if name == "rpc":
+        from snapshot import get_client
+
+        supabase = get_client()
+
+        def search_rpc(q: np.ndarray, k: int) -> List[dict]:
+            literal = "[" + ",".join(f"{x:.6f}" for x in q) + "]"
+            return supabase.rpc("match_documents", {"query_embedding": literal, "match_count": k}).execute().data or []
+
+        return search_rpc, None
+
+    index = LocalIndex(rows, matrix, **local_backend(name))
+    return (lambda q, k: index.search(q, k)[0]), index.memory_stats()["resident_bytes"]
+
+
+# ─────────────────────────  metrics  ──────────────────────── #
+def evaluate(search, queries: np.ndarray, truth_ids: List[List], k: int) -> dict:
+    recalls, reciprocal_ranks, latencies = [], [], []
+    for q, truth in zip(queries, truth_ids):
+        started = time.perf_counter()
+        found = [r["id"] for r in search(q, k)]
+        latencies.append((time.perf_counter() - started) * 1000)
+
+        recalls.append(len(set(found) & set(truth)) / len(truth))
+        rank = found.index(truth[0]) + 1 if truth[0] in found else None
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "recall": float(np.mean(recalls)),
+        "mrr":    float(np.mean(reciprocal_ranks)),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recall@k / MRR / latency of retrieval backends vs exact search.")
+    parser.add_argument("--snapshot", help="snapshot directory (default: synthetic corpus)")
+    parser.add_argument("--query-embeddings", help=".npy of query embeddings (with --snapshot)")
+    parser.add_argument("--docs", type=int, default=20000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=768, help="synthetic embedding dimension")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--backends", default=DEFAULT_BACKENDS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        rows, matrix, queries = from_snapshot(args.snapshot, args.query_embeddings, args.queries, args.seed)
+    else:
+        rows, matrix, queries = synthetic(args.docs, args.queries, args.dim, args.seed)
+
+    scores    = queries @ matrix.T
+    top       = np.argsort(-scores, axis=1)[:, :args.k]
+    truth_ids = [[rows[i]["id"] for i in row] for row in top]
+
+    print(f"{len(rows)} docs × {matrix.shape[1]} dims, {len(queries)} queries, k={args.k}")
+    print(f"{'backend':<18} {'recall@k':>9} {'MRR':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'build s':>8} {'index MB':>9}")
+    results = {}
+    for name in args.backends.split(","):
+        started = time.perf_counter()
+        search, resident = build_backend(name, rows, matrix)
+        build_s = time.perf_counter() - started
+
+        result = evaluate(search, queries, truth_ids, args.k)
+        result.update(build_s=build_s, resident_bytes=resident)
+        results[name] = result
+        size = f"{resident / 2**20:.1f}" if resident is not None else "-"
+        print(f"{name:<18} {result['recall']:>9.3f} {result['mrr']:>6.3f} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {build_s:>8.2f} {size:>9}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"docs": len(rows), "queries": len(queries), "k": args.k, "backends": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
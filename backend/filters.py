@@ -0,0 +1,40 @@
+from typing import List, Optional
+
+from local_index import parse_timestamp
+
+
+def parse_tags(tags) -> List[str]:
+    """Accept a list or a comma-separated string; drop blanks and duplicates."""
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    if not isinstance(tags, list) or not all(isinstance(t, str) for t in tags):
+        raise ValueError("tags must be a list of strings or a comma-separated string.")
+    return list(dict.fromkeys(t.strip() for t in tags if t.strip()))
+
+
+def parse_filters(raw: Optional[dict]) -> dict:
+    """
+    Validate the optional `filters` object of a request. Returns only the keys
+    that are set: collection, tags, uploaded_after, uploaded_before.
+    """
+    if raw is None:
+        return {}
+    if not isinstance(raw, dict):
+        raise ValueError("filters must be an object.")
+
+    filters = {}
+    collection = raw.get("collection")
+    if collection is not None and not isinstance(collection, str):
+        raise ValueError("collection must be a string.")
+    if collection:
+        filters["collection"] = collection
+    if raw.get("tags"):
+        filters["tags"] = parse_tags(raw["tags"])
+    for key in ("uploaded_after", "uploaded_before"):
+        value = raw.get(key)
+        if value is None or value == "":
+            continue
+        if not isinstance(value, str) or parse_timestamp(value) is None:
+            raise ValueError(f"{key} must be an ISO-8601 timestamp.")
+        filters[key] = value
+    return filters
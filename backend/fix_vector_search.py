@@ -102,15 +102,39 @@ def create_match_documents_function():
         else:
             print("pgvector extension is already installed")
         
-        # Create the match_documents function
+        # Namespace / metadata columns used for filter pushdown
+        cursor.execute("""
+        ALTER TABLE documents
+            ADD COLUMN IF NOT EXISTS collection TEXT NOT NULL DEFAULT 'default',
+            ADD COLUMN IF NOT EXISTS tags TEXT[] NOT NULL DEFAULT '{}',
+            ADD COLUMN IF NOT EXISTS uploaded_at TIMESTAMPTZ NOT NULL DEFAULT now();
+        CREATE INDEX IF NOT EXISTS documents_collection_idx ON documents (collection, uploaded_at);
+        CREATE INDEX IF NOT EXISTS documents_tags_idx ON documents USING gin (tags);
+        CREATE INDEX IF NOT EXISTS documents_uploaded_at_idx ON documents (uploaded_at);
+        """)
+        conn.commit()
+        print("documents table has collection, tags and uploaded_at columns")
+
+        # Create the match_documents function. The filters sit in the same
+        # WHERE clause as the vector ordering, so Postgres can narrow to the
+        # tenant's rows (via the btree/GIN indexes) before ranking them.
+        # The return type changed, so the old signature has to be dropped.
+        cursor.execute("DROP FUNCTION IF EXISTS match_documents(TEXT, INT)")
         cursor.execute("""
         CREATE OR REPLACE FUNCTION match_documents(
             query_embedding TEXT,
-            match_count INT DEFAULT 5
+            match_count INT DEFAULT 5,
+            filter_collection TEXT DEFAULT NULL,
+            filter_tags TEXT[] DEFAULT NULL,
+            uploaded_after TIMESTAMPTZ DEFAULT NULL,
+            uploaded_before TIMESTAMPTZ DEFAULT NULL
         ) RETURNS TABLE (
             id BIGINT,
             filename TEXT,
             content TEXT,
+            collection TEXT,
+            tags TEXT[],
+            uploaded_at TIMESTAMPTZ,
             similarity REAL
         )
         LANGUAGE plpgsql
@@ -121,10 +145,17 @@ def create_match_documents_function():
                 d.id,
                 d.filename,
                 d.content,
+                d.collection,
+                d.tags,
+                d.uploaded_at,
                 1 - (d.embedding <=> query_embedding::vector) AS similarity
             FROM
                 documents d
             WHERE d.embedding IS NOT NULL
+              AND (filter_collection IS NULL OR d.collection = filter_collection)
+              AND (filter_tags IS NULL OR d.tags @> filter_tags)
+              AND (uploaded_after IS NULL OR d.uploaded_at >= uploaded_after)
+              AND (uploaded_before IS NULL OR d.uploaded_at < uploaded_before)
             ORDER BY
                 d.embedding <=> query_embedding::vector
             LIMIT match_count;
@@ -133,6 +164,77 @@ def create_match_documents_function():
         """)
         conn.commit()
         print("Successfully created match_documents function")
+
+        # Server-side clear used by /clear, so the API never has to list ids.
+        # Runs with the caller's rights and only the service role may call it;
+        # otherwise anyone with the anon key could truncate through PostgREST.
+        cursor.execute("""
+        CREATE OR REPLACE FUNCTION clear_documents()
+        RETURNS BIGINT
+        LANGUAGE plpgsql
+        SECURITY INVOKER
+        SET search_path = public
+        AS $$
+        DECLARE
+            removed BIGINT;
+        BEGIN
+            SELECT count(*) INTO removed FROM documents;
+            TRUNCATE documents;
+            RETURN removed;
+        END;
+        $$;
+        REVOKE EXECUTE ON FUNCTION clear_documents() FROM PUBLIC, anon, authenticated;
+        GRANT EXECUTE ON FUNCTION clear_documents() TO service_role;
+        """)
+        conn.commit()
+        print("Successfully created clear_documents function")
+
+        # Change feed for replicas' local indexes: updated_at on every write,
+        # a tombstone per deleted row and one with NULL id per TRUNCATE
+        cursor.execute("""
+        ALTER TABLE documents
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp();
+        CREATE INDEX IF NOT EXISTS documents_updated_at_idx ON documents (updated_at, id);
+
+        CREATE TABLE IF NOT EXISTS document_tombstones (
+            seq BIGSERIAL PRIMARY KEY,
+            document_id TEXT,
+            deleted_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+        );
+        CREATE INDEX IF NOT EXISTS document_tombstones_deleted_at_idx ON document_tombstones (deleted_at);
+
+        CREATE OR REPLACE FUNCTION documents_touch() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.updated_at := clock_timestamp();
+            RETURN NEW;
+        END;
+        $$;
+
+        CREATE OR REPLACE FUNCTION documents_tombstone() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                INSERT INTO document_tombstones (document_id) VALUES (NULL);
+            ELSE
+                INSERT INTO document_tombstones (document_id) VALUES (OLD.id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$;
+
+        DROP TRIGGER IF EXISTS documents_touch ON documents;
+        CREATE TRIGGER documents_touch BEFORE INSERT OR UPDATE ON documents
+            FOR EACH ROW EXECUTE FUNCTION documents_touch();
+        DROP TRIGGER IF EXISTS documents_tombstone ON documents;
+        CREATE TRIGGER documents_tombstone AFTER DELETE ON documents
+            FOR EACH ROW EXECUTE FUNCTION documents_tombstone();
+        DROP TRIGGER IF EXISTS documents_truncate_tombstone ON documents;
+        CREATE TRIGGER documents_truncate_tombstone AFTER TRUNCATE ON documents
+            FOR EACH STATEMENT EXECUTE FUNCTION documents_tombstone();
+        """)
+        conn.commit()
+        print("documents change feed (updated_at, document_tombstones) is set up")
         
         # Verify documents table has vector column
         cursor.execute("""
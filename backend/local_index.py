@@ -0,0 +1,471 @@
+import os
+import logging
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from quantization import hamming_distances, int8_scores, quantize_binary, quantize_int8, shortlist
+from sharded_search import ShardedSearcher
+
+log = logging.getLogger("uvicorn.error")
+
+QUANTIZATION_MODES = ("none", "int8", "binary")
+# shortlist size = k × oversample; sign bits lose more ranking detail than int8.
+# "none" only applies when a reduced-dimension first pass is configured.
+DEFAULT_OVERSAMPLE = {"none": 4, "int8": 4, "binary": 10}
+
+# apply_changes() leaves deleted rows masked and new rows in delta segments;
+# past this many of either (or 10% of the index) it is worth rebuilding with
+# compacted()
+COMPACT_MIN_ROWS = 1000
+
+# search() scores queries in blocks so one (queries × rows) float32 score
+# matrix stays under this size, however large the batch
+SCORE_BLOCK_BYTES = 64 * 2**20
+
+
+def parse_embedding(emb: Union[str, List[float]]) -> List[float]:
+    """
+    Ensure embedding is a list of floats, parsing if it's a string.
+    """
+    if isinstance(emb, list):
+        return emb
+    if isinstance(emb, str):
+        # strip brackets and split
+        try:
+            vals = emb.strip('[]').split(',')
+            return [float(x) for x in vals if x]
+        except Exception:
+            log.warning("Failed to parse embedding string: %s", emb[:100])
+    return []
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Postgres/ISO-8601 timestamp into epoch seconds. Naive values are
+    taken as UTC; unparseable values return None.
+    """
+    if not value:
+        return None
+    text = value.strip().replace(" ", "T", 1)
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    # Postgres trims trailing zeros from the fraction, older fromisoformat()
+    # only accepts exactly 3 or 6 digits.
+    if "." in text:
+        head, _, rest = text.partition(".")
+        digits = len(rest) - len(rest.lstrip("0123456789"))
+        text = head + "." + rest[:digits].ljust(6, "0")[:6] + rest[digits:]
+    try:
+        ts = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def latest_timestamp(*values: Optional[str]) -> Optional[str]:
+    """The latest of several timestamp strings (None and unparseable ignored)."""
+    best, best_ts = None, None
+    for value in values:
+        ts = parse_timestamp(value)
+        if ts is not None and (best_ts is None or ts > best_ts):
+            best, best_ts = value, ts
+    return best
+
+
+def document_row(d: dict) -> dict:
+    """The fields of a `documents` row kept alongside its vector."""
+    return {
+        "id":          d.get("id"),
+        "filename":    d.get("filename"),
+        "content":     d.get("content"),
+        "collection":  d.get("collection"),
+        "tags":        d.get("tags") or [],
+        "uploaded_at": d.get("uploaded_at"),
+        "updated_at":  d.get("updated_at"),
+    }
+
+
+def document_vectors(docs: Iterable[dict], dim: int) -> Tuple[List[dict], np.ndarray]:
+    """Rows and normalised (n, dim) matrix for documents with a valid embedding."""
+    rows, vectors = [], []
+    for d in docs:
+        emb = parse_embedding(d.get("embedding"))
+        if len(emb) != dim:
+            continue
+        rows.append(document_row(d))
+        vectors.append(emb)
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), dim)
+    return rows, normalize_rows(matrix)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalise each row; all-zero rows are left as zeros."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def spill_to_disk(matrix: np.ndarray) -> np.ndarray:
+    """
+    Copy `matrix` into an anonymous memory-mapped file (under LOCAL_INDEX_DIR
+    if set). Only the pages of rows that are actually read stay resident.
+    """
+    if not matrix.size:
+        return matrix
+    with tempfile.TemporaryFile(dir=os.getenv("LOCAL_INDEX_DIR")) as handle:
+        mapped = np.memmap(handle, dtype=np.float32, mode="w+", shape=matrix.shape)
+    mapped[:] = matrix
+    return mapped
+
+
+class _Segment(NamedTuple):
+    """A delta segment and the rows of it deleted since it was written."""
+    index:    "LocalIndex"
+    dead:     np.ndarray
+    dead_ids: FrozenSet[str]
+
+    @property
+    def live(self) -> int:
+        return len(self.index.rows) - len(self.dead_ids)
+
+
+class _View(NamedTuple):
+    """Everything apply_changes() changes, swapped in as one object."""
+    dead:     np.ndarray
+    dead_ids: FrozenSet[str]
+    segments: Tuple[_Segment, ...]
+
+
+def _masked(index: "LocalIndex", dead: np.ndarray, dead_ids: FrozenSet[str], ids: set):
+    """Copies of (dead, dead_ids) with `ids` also masked; the inputs if none are new."""
+    hits = [(doc_id, index._position[doc_id]) for doc_id in ids
+            if doc_id in index._position and doc_id not in dead_ids]
+    if not hits:
+        return dead, dead_ids
+    dead = dead.copy()
+    dead[[pos for _, pos in hits]] = True
+    return dead, dead_ids | {doc_id for doc_id, _ in hits}
+
+
+def _live_rows(index: "LocalIndex", dead: np.ndarray) -> Tuple[List[dict], np.ndarray]:
+    live = np.flatnonzero(~dead)
+    return [index.rows[i] for i in live], np.asarray(index.matrix[live], dtype=np.float32)
+
+
+class LocalIndex:
+    """
+    In-memory copy of the `documents` table used for exact cosine search.
+
+    Embeddings are stored as one L2-normalised float32 matrix so that scoring
+    any number of queries is a single matrix-matrix product. Collection, tag
+    and upload-date filters select rows *before* scoring, so a filtered search
+    only pays for the rows it can return.
+
+    With `quantization="int8"` or `"binary"` the scan runs over compact codes
+    (4x / 32x smaller) and only a shortlist of k × oversample candidates is
+    rescored against the full-precision vectors, which are moved to a
+    memory-mapped file so they no longer count against resident memory.
+
+    With `prefix_dim` the first pass only looks at the leading `prefix_dim`
+    dimensions of each embedding, re-normalised (text-embedding-004 is trained
+    Matryoshka-style, so prefixes remain usable embeddings). This cuts the scan
+    cost by dim / prefix_dim and composes with quantization, which is then
+    applied to the prefix vectors.
+
+    With `workers > 1` an exact (non-quantized, no prefix) index is split into
+    row shards scored in parallel by a process pool over shared memory.
+    Filtered searches stay in-process since they only touch the selected rows.
+
+    apply_changes() keeps the index current without a reload: deleted or
+    replaced rows are masked out of the main arrays and new versions go into
+    small exact delta segments searched alongside it. Segments are merged
+    log-structured style (a segment absorbs the next when they are of similar
+    size), so each row is copied O(log n) times rather than on every change.
+    `watermark` is the latest change (DB timestamp) reflected in the index.
+
+    Searches never take a lock: writers build a new immutable view (masks
+    and segment list) and publish it with a single attribute assignment.
+    """
+
+    def __init__(
+        self,
+        rows: List[dict],
+        matrix: np.ndarray,
+        quantization: str = "none",
+        oversample: Optional[int] = None,
+        prefix_dim: Optional[int] = None,
+        workers: int = 0,
+    ):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"quantization must be one of {QUANTIZATION_MODES}, got {quantization!r}")
+        matrix = matrix.astype(np.float32, copy=False)
+
+        self.rows         = rows
+        self.quantization = quantization
+        self.oversample   = oversample or DEFAULT_OVERSAMPLE[quantization]
+        self.prefix_dim   = prefix_dim if prefix_dim and prefix_dim < matrix.shape[1] else None
+        self._codes       = None
+        self._scales      = None
+
+        first_stage = self._reduce(matrix)
+        if quantization == "int8":
+            self._codes, self._scales = quantize_int8(first_stage)
+        elif quantization == "binary":
+            self._codes = quantize_binary(first_stage)
+        elif self.prefix_dim:
+            self._codes = np.ascontiguousarray(first_stage)
+        self.matrix = matrix if quantization == "none" else spill_to_disk(matrix)
+
+        self._sharded = None
+        if workers > 1 and not self.two_stage and len(rows):
+            self._sharded = ShardedSearcher(self.matrix, workers)
+            self.matrix = self._sharded.matrix   # share the copy, don't keep two
+
+        self._collections = np.array([r.get("collection") for r in rows], dtype=object)
+        self._tags        = [frozenset(r.get("tags") or ()) for r in rows]
+        self._uploaded_at = np.array(
+            [parse_timestamp(r.get("uploaded_at")) or np.nan for r in rows],
+            dtype=np.float64,
+        )
+
+        self.options   = {"quantization": quantization, "oversample": oversample,
+                          "prefix_dim": prefix_dim, "workers": workers}
+        self.watermark = latest_timestamp(*(r.get("updated_at") for r in rows))
+        # watermark at build time; a TRUNCATE after it invalidates the index
+        self.base_watermark = self.watermark
+        self._position = {str(r["id"]): i for i, r in enumerate(rows)}
+        self._view     = _View(np.zeros(len(rows), dtype=bool), frozenset(), ())
+        # serialises writers only; set while compacted() copies the view,
+        # and to the replacement index once it is done
+        self._lock      = threading.RLock()
+        self._pending: Optional[List[Tuple[List[dict], List]]] = None
+        self._successor: Optional["LocalIndex"] = None
+
+    @classmethod
+    def from_documents(cls, docs: Iterable[dict], dim: int, **options) -> "LocalIndex":
+        rows, matrix = document_vectors(docs, dim)
+        return cls(rows, matrix, **options)
+
+    @classmethod
+    def from_snapshot(cls, path: str, **options) -> "LocalIndex":
+        """Build from a `snapshot.py export` directory without touching the table."""
+        from snapshot import read_snapshot
+
+        rows, matrix = read_snapshot(path)
+        return cls(rows, normalize_rows(np.asarray(matrix, dtype=np.float32)), **options)
+
+    def __len__(self) -> int:
+        view = self._view
+        return len(self.rows) - len(view.dead_ids) + sum(seg.live for seg in view.segments)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    @property
+    def two_stage(self) -> bool:
+        return self._codes is not None
+
+    def _reduce(self, vectors: np.ndarray) -> np.ndarray:
+        """First-pass view of `vectors`: the re-normalised prefix, or the vectors as-is."""
+        if not self.prefix_dim:
+            return vectors
+        return normalize_rows(vectors[:, :self.prefix_dim])
+
+    def memory_stats(self) -> dict:
+        view       = self._view
+        delta      = sum(len(seg.index.rows) for seg in view.segments)
+        full_bytes = (len(self.rows) + delta) * self.dim * 4
+        # delta segments are always exact float32
+        resident = full_bytes if self.quantization == "none" else delta * self.dim * 4
+        if self.two_stage:
+            resident += self._codes.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+        return {
+            "rows":                 len(self),
+            "main_rows":            len(self.rows),
+            "delta_rows":           sum(seg.live for seg in view.segments),
+            "dead_rows":            len(view.dead_ids) + sum(len(seg.dead_ids) for seg in view.segments),
+            "dim":                  self.dim,
+            "prefix_dim":           self.prefix_dim,
+            "quantization":         self.quantization,
+            "shards":               len(self._sharded) if self._sharded is not None else 1,
+            "full_precision_bytes": full_bytes,
+            "resident_bytes":       resident,
+            "saving":               round(full_bytes / resident, 1) if resident else 1.0,
+        }
+
+    def select(self, filters: Optional[dict] = None, dead: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """
+        Live row positions matching `filters` (see filters.parse_filters), or
+        None when no filter is set and the whole corpus is searched.
+        """
+        if not filters:
+            return None
+
+        mask = ~(self._view.dead if dead is None else dead)
+        if filters.get("collection"):
+            mask &= self._collections == filters["collection"]
+        if filters.get("tags"):
+            wanted = frozenset(filters["tags"])
+            mask &= np.fromiter((wanted <= t for t in self._tags), dtype=bool, count=len(self._tags))
+        if filters.get("uploaded_after"):
+            mask &= self._uploaded_at >= parse_timestamp(filters["uploaded_after"])
+        if filters.get("uploaded_before"):
+            mask &= self._uploaded_at < parse_timestamp(filters["uploaded_before"])
+        return np.flatnonzero(mask)
+
+    # ─────────────────────  incremental updates  ─────────────────── #
+    def apply_changes(self, upserts: Iterable[dict], deleted_ids: Iterable = ()) -> None:
+        """
+        Apply inserted/updated `documents` rows (with embeddings) and deleted
+        ids in place. Unknown deleted ids are ignored, so replaying a change
+        twice is harmless; a row that is both upserted and deleted stays
+        deleted.
+        """
+        upserts, deleted_ids = list(upserts), list(deleted_ids)
+        with self._lock:
+            if self._successor is not None:
+                return self._successor.apply_changes(upserts, deleted_ids)
+            if self._pending is not None:
+                self._pending.append((upserts, deleted_ids))
+
+            deleted = {str(i) for i in deleted_ids}
+            new_rows, new_matrix = document_vectors(upserts, self.dim)
+            keep = [i for i, r in enumerate(new_rows) if str(r["id"]) not in deleted]
+            new_rows, new_matrix = [new_rows[i] for i in keep], new_matrix[keep]
+            touched = deleted | {str(r["id"]) for r in new_rows}
+
+            view = self._view
+            dead, dead_ids = _masked(self, view.dead, view.dead_ids, touched)
+            segments = [_Segment(seg.index, *_masked(seg.index, seg.dead, seg.dead_ids, touched))
+                        for seg in view.segments]
+            segments = [seg for seg in segments if seg.live]
+            if new_rows:
+                index = LocalIndex(new_rows, new_matrix)
+                segments.append(_Segment(index, index._view.dead, frozenset()))
+                # merge the newest segment into its predecessor while they are
+                # of similar size, keeping segments few and copies amortised
+                while len(segments) > 1 and segments[-2].live <= 2 * segments[-1].live:
+                    b, a = segments.pop(), segments.pop()
+                    rows_a, matrix_a = _live_rows(a.index, a.dead)
+                    rows_b, matrix_b = _live_rows(b.index, b.dead)
+                    index = LocalIndex(rows_a + rows_b, np.vstack([matrix_a, matrix_b]))
+                    segments.append(_Segment(index, index._view.dead, frozenset()))
+            self._view = _View(dead, dead_ids, tuple(segments))
+
+    @property
+    def needs_compaction(self) -> bool:
+        view = self._view
+        pending = len(view.dead_ids) + sum(len(seg.index.rows) for seg in view.segments)
+        return pending > max(COMPACT_MIN_ROWS, len(self.rows) // 10)
+
+    def compacted(self) -> "LocalIndex":
+        """
+        A fresh index of the live rows (main + delta), built without the DB.
+        Searches and writes continue on this index while it is built; writes
+        made meanwhile are replayed onto the new one, and later ones are
+        forwarded to it.
+        """
+        with self._lock:
+            self._pending = []
+            view = self._view
+
+        rows, matrix = _live_rows(self, view.dead)
+        parts = [matrix]
+        for seg in view.segments:
+            seg_rows, seg_matrix = _live_rows(seg.index, seg.dead)
+            rows = rows + seg_rows
+            parts.append(seg_matrix)
+        index = LocalIndex(rows, np.vstack(parts), **self.options)
+
+        with self._lock:
+            for upserts, deleted_ids in self._pending:
+                index.apply_changes(upserts, deleted_ids)
+            self._pending   = None
+            self._successor = index
+            index.watermark      = self.watermark
+            index.base_watermark = self.base_watermark
+        return index
+
+    # ─────────────────────────  search  ─────────────────────────── #
+    def search(
+        self,
+        queries: Union[np.ndarray, Sequence[Sequence[float]]],
+        k: int = 5,
+        filters: Optional[dict] = None,
+    ) -> List[List[dict]]:
+        """Return the top-k rows (with cosine similarity) for every query row."""
+        q = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        view  = self._view   # one consistent snapshot; writers publish a new one
+        block = max(1, SCORE_BLOCK_BYTES // (4 * max(len(self.rows), 1)))
+        found: List[List[dict]] = []
+        for start in range(0, len(q), block):
+            found.extend(self._search_view(q[start:start + block], k, filters, view))
+        return found
+
+    def _search_view(self, q: np.ndarray, k: int, filters: Optional[dict], view: _View) -> List[List[dict]]:
+        found = self._search_live(q, k, filters, view.dead, view.dead_ids)
+        for seg in view.segments:
+            extra = seg.index._search_live(q, k, filters, seg.dead, seg.dead_ids)
+            found = [sorted(a + b, key=lambda r: r["similarity"], reverse=True)[:k] for a, b in zip(found, extra)]
+        return [rows[:k] for rows in found]
+
+    def _search_live(
+        self, q: np.ndarray, k: int, filters: Optional[dict], dead: np.ndarray, dead_ids: FrozenSet[str],
+    ) -> List[List[dict]]:
+        # unfiltered searches can still hit masked rows: over-fetch, then drop
+        found = self._search_main(q, k + len(dead_ids), filters, dead)
+        if dead_ids:
+            found = [[r for r in rows if str(r["id"]) not in dead_ids] for rows in found]
+        return found
+
+    def _search_main(self, q: np.ndarray, k: int, filters: Optional[dict], dead: np.ndarray) -> List[List[dict]]:
+        positions = self.select(filters, dead)
+        n_rows = len(self.rows) if positions is None else len(positions)
+        if not n_rows or k <= 0:
+            return [[] for _ in range(len(q))]
+
+        if self._sharded is not None and positions is None:
+            indices, scores = self._sharded.search(q, min(k, n_rows))
+            return [
+                [{**self.rows[i], "similarity": float(sc)} for i, sc in zip(row_i, row_s)]
+                for row_i, row_s in zip(indices, scores)
+            ]
+
+        if not self.two_stage:
+            matrix = self.matrix if positions is None else self.matrix[positions]
+            scores = q @ matrix.T                           # (n_queries, n_candidates)
+            return [self._top_k(row, k, positions) for row in scores]
+
+        candidates = self._shortlist(q, positions, k * self.oversample)
+        if positions is not None:
+            candidates = positions[candidates]
+        return [self._rescore(qi, cand, k) for qi, cand in zip(q, candidates)]
+
+    def _shortlist(self, q: np.ndarray, positions: Optional[np.ndarray], n: int) -> np.ndarray:
+        q = self._reduce(q)
+        codes = self._codes if positions is None else self._codes[positions]
+        if self.quantization == "none":
+            return shortlist(q @ codes.T, n)
+        if self.quantization == "int8":
+            scales = self._scales if positions is None else self._scales[positions]
+            return shortlist(int8_scores(q, codes, scales), n)
+        return shortlist(hamming_distances(quantize_binary(q), codes), n, largest=False)
+
+    def _rescore(self, q: np.ndarray, candidates: np.ndarray, k: int) -> List[dict]:
+        # sorted reads keep memory-mapped access sequential
+        candidates = np.sort(candidates)
+        return self._top_k(self.matrix[candidates] @ q, k, candidates)
+
+    def _top_k(self, scores: np.ndarray, k: int, positions: Optional[np.ndarray] = None) -> List[dict]:
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = top if positions is None else positions[top]
+        return [{**self.rows[r], "similarity": float(scores[i])} for i, r in zip(top, rows)]
@@ -1,41 +1,185 @@
 import os
+import json
+import asyncio
 import tempfile
 import logging
-from typing import List, Union
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 from pprint import pformat
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, UploadFile, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import fitz                          # PyMuPDF
 import google.generativeai as genai
-from supabase import create_client, Client
+import numpy as np
+from multipart.multipart import MultipartParser, parse_options_header
+
+from filters import parse_filters, parse_tags
+from local_index import LocalIndex
+from request_body import read_json_object
+from scheduler import BULK, INTERACTIVE, AdmissionController, Overloaded
+from single_flight import SingleFlight
+from snippets import make_snippet
+from vector_store import DEFAULT_COLLECTION, store_from_env
 
 # ───────────────────────── CONFIG ────────────────────────── #
 load_dotenv()
 
-SUPABASE_URL         = os.environ["SUPABASE_URL"]
-SUPABASE_SERVICE_KEY = os.environ["SUPABASE_SERVICE_KEY"]
 GEMINI_API_KEY       = os.environ["GEMINI_API_KEY"]
 
 genai.configure(api_key=GEMINI_API_KEY)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-# Debug requests - uncomment if needed after fixing structure
-# import httpx
-# def log_request(r: httpx.Request):
-#     print("→", r.method, r.url, r.content)
-# supabase.postgrest.client.http._client.event_xhooks["request"] = [log_request]
 
 GEMINI_LLM_MODEL   = "gemini-2.5-flash-preview-04-17"
 GEMINI_EMBED_MODEL = "models/text-embedding-004"
 EMBED_DIM          = 768   # must match your vector column & RPC cast
 
+EMBED_BATCH_SIZE   = 100   # Gemini batchEmbedContents limit per request
+# Local index representation: "none" (float32), "int8" or "binary" codes with
+# exact rescoring of a k × LOCAL_INDEX_OVERSAMPLE shortlist
+LOCAL_INDEX_QUANTIZATION = os.getenv("LOCAL_INDEX_QUANTIZATION", "none")
+LOCAL_INDEX_OVERSAMPLE   = int(os.getenv("LOCAL_INDEX_OVERSAMPLE", "0")) or None
+# >0 enables a first pass over the first N (re-normalised) dims, e.g. 128/256
+LOCAL_INDEX_PREFIX_DIM   = int(os.getenv("LOCAL_INDEX_PREFIX_DIM", "0")) or None
+
+# >1 splits an exact local index across this many worker processes
+LOCAL_INDEX_WORKERS      = int(os.getenv("LOCAL_INDEX_WORKERS", "0"))
+# "rpc" searches with match_documents and falls back to the local index;
+# "local" always uses the local index
+SEARCH_BACKEND           = os.getenv("SEARCH_BACKEND", "rpc")
+# Optional `snapshot.py export` directory used for the first local index load
+LOCAL_INDEX_SNAPSHOT     = os.getenv("LOCAL_INDEX_SNAPSHOT")
+
+MAX_UPLOAD_BYTES   = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+MAX_FORM_FIELD_BYTES = 64 * 1024   # non-file /upload fields (collection, tags)
+# /upload parses its body itself; describe the form for the OpenAPI docs
+UPLOAD_OPENAPI = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object",
+    "required": ["pdfs"],
+    "properties": {
+        "pdfs":       {"type": "array", "items": {"type": "string", "format": "binary"}},
+        "collection": {"type": "string", "default": "default"},
+        "tags":       {"type": "string", "description": "comma-separated"},
+    },
+}}}}}
+PIPELINE_DEPTH     = 2             # documents buffered between ingestion stages
+
+MAX_BATCH_QUERIES  = int(os.getenv("MAX_BATCH_QUERIES", "500"))
+MAX_BATCH_K        = int(os.getenv("MAX_BATCH_K", "20"))   # matches retrieved per batch question
+BATCH_CONCURRENCY  = int(os.getenv("BATCH_CONCURRENCY", "8"))
+MAX_SEARCH_RESULTS = int(os.getenv("MAX_SEARCH_RESULTS", "100"))   # /search offset + limit
+
+# Admission control for upstream calls: (concurrency, max queued, max seconds
+# queued) per priority class and resource. Interactive /query traffic gets its
+# own slots and fails fast; bulk work (uploads, batches, deletes) is capped
+# lower but may queue for longer. Bulk generation only serves /query/batch,
+# so it is sized by BATCH_CONCURRENCY.
+INTERACTIVE_CONCURRENCY = int(os.getenv("INTERACTIVE_CONCURRENCY", "8"))
+BULK_CONCURRENCY        = int(os.getenv("BULK_CONCURRENCY", "2"))
+ADMISSION_LIMITS = {
+    INTERACTIVE: {
+        "embed":    (INTERACTIVE_CONCURRENCY, 4 * INTERACTIVE_CONCURRENCY, 5.0),
+        "generate": (INTERACTIVE_CONCURRENCY, 4 * INTERACTIVE_CONCURRENCY, 10.0),
+        "db":       (INTERACTIVE_CONCURRENCY, 4 * INTERACTIVE_CONCURRENCY, 5.0),
+    },
+    BULK: {
+        "embed":    (BULK_CONCURRENCY, 32 * BULK_CONCURRENCY, 120.0),
+        "generate": (BATCH_CONCURRENCY, 32 * BATCH_CONCURRENCY, 120.0),
+        "db":       (BULK_CONCURRENCY, 32 * BULK_CONCURRENCY, 120.0),
+    },
+}
+scheduler = AdmissionController(ADMISSION_LIMITS)
+
+# Warm-up on startup; set WARMUP_LOCAL_INDEX=0 to skip preloading the local
+# index (e.g. when the RPC is always available and the table is large)
+WARMUP_LOCAL_INDEX = os.getenv("WARMUP_LOCAL_INDEX", "1") != "0"
+
+# Change-feed sync of the local index: poll every SYNC_INTERVAL seconds for
+# rows changed since the index's watermark (0 disables); more than
+# SYNC_MAX_CHANGES changed rows triggers a full reload instead
+SYNC_INTERVAL      = float(os.getenv("SYNC_INTERVAL", "5"))
+SYNC_MAX_CHANGES   = int(os.getenv("SYNC_MAX_CHANGES", "5000"))
+
 # integrate with Uvicorn's logger
 log = logging.getLogger("uvicorn.error")
 
+# Where documents and embeddings live: VECTOR_STORE=supabase (default) or
+# sqlite, an embedded single-node engine under VECTOR_STORE_PATH
+store = store_from_env(
+    EMBED_DIM,
+    index_options={
+        "quantization": LOCAL_INDEX_QUANTIZATION,
+        "oversample":   LOCAL_INDEX_OVERSAMPLE,
+        "prefix_dim":   LOCAL_INDEX_PREFIX_DIM,
+        "workers":      LOCAL_INDEX_WORKERS,
+    },
+    snapshot=LOCAL_INDEX_SNAPSHOT,
+    sync_max_changes=SYNC_MAX_CHANGES,
+)
+
 # ──────────────────────  FASTAPI setup  ───────────────────── #
-app = FastAPI()
+# Readiness state filled in by warm_up(); /readyz reports it.
+warmup_state = {"ready": False, "steps": {}}
+
+
+async def warm_up() -> None:
+    """
+    Pay the cold-start costs before taking traffic: open the vector store and
+    Gemini connections, load the local index and run one synthetic embed.
+    A failing step is logged and reported but does not block readiness.
+    """
+    steps = [
+        ("store",    store.stats),
+        ("embed",    lambda: embed("warm-up", "retrieval_query")),
+        ("llm",      lambda: get_llm().count_tokens("warm-up")),
+    ]
+    if WARMUP_LOCAL_INDEX:
+        steps.append(("local_index", lambda: len(store.local_index())))
+
+    for name, step in steps:
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(step)
+            warmup_state["steps"][name] = {"ok": True}
+        except Exception as e:
+            log.warning("Warm-up step %s failed: %s", name, e)
+            warmup_state["steps"][name] = {"ok": False, "error": str(e)}
+        warmup_state["steps"][name]["seconds"] = round(time.monotonic() - started, 3)
+
+    warmup_state["ready"] = True
+    log.info("Warm-up finished ➜ %s", warmup_state["steps"])
+
+
+async def sync_loop() -> None:
+    """Keep the local index current with other replicas' writes; back off on errors."""
+    delay = SYNC_INTERVAL
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await scheduler.run(BULK, "db", store.sync)
+            delay = SYNC_INTERVAL
+        except Overloaded:
+            pass
+        except Exception as e:
+            delay = min(delay * 2, 300.0)
+            log.warning("Local index sync failed (next try in %.0fs): %s", delay, e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # run in the background so /healthz answers while warm-up is in progress
+    tasks = [asyncio.create_task(warm_up())]
+    if SYNC_INTERVAL > 0:
+        tasks.append(asyncio.create_task(sync_loop()))
+    yield
+    for task in tasks:
+        task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -44,11 +188,107 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    log.warning("Shedding %s %s: %s", request.method, request.url.path, exc)
+    return JSONResponse(
+        status_code=429,
+        content={"error": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # ────────────────────  Helper functions  ──────────────────── #
 def extract_text_from_pdf(path: str) -> str:
     with fitz.open(path) as doc:
         return "".join(page.get_text() for page in doc)
 
+class UploadTooLarge(ValueError):
+    pass
+
+async def read_upload_form(request: Request) -> Tuple[List[Tuple[str, str]], Dict[str, str]]:
+    """
+    Parse a multipart/form-data body as it streams in. Every file part is
+    written straight to its own temp file and plain fields are kept in
+    memory; returns ([(filename, path)], {name: value}). MAX_UPLOAD_BYTES is
+    enforced per file while reading, so an oversized file is refused without
+    receiving the rest of the body. On error the temp files are removed and
+    ValueError (UploadTooLarge for the size limit) is raised; otherwise the
+    caller removes them.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise ValueError("Expected a multipart/form-data body.")
+
+    files:  List[Tuple[str, str]] = []
+    fields: Dict[str, str] = {}
+    part:   dict = {}
+
+    def on_part_begin() -> None:
+        part.clear()
+        part.update(headers={}, field=b"", value=b"", size=0, sink=None, data=bytearray())
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        part["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        part["value"] += data[start:end]
+
+    def on_header_end() -> None:
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+
+    def on_headers_finished() -> None:
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = disposition.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in disposition:
+            part["filename"] = disposition[b"filename"].decode("utf-8", "replace")
+            part["sink"] = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+            files.append((part["filename"], part["sink"].name))
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        part["size"] += end - start
+        if part["sink"] is not None:
+            if part["size"] > MAX_UPLOAD_BYTES:
+                raise UploadTooLarge(f"{part['filename']} exceeds the {MAX_UPLOAD_BYTES} byte upload limit.")
+            part["sink"].write(data[start:end])
+        else:
+            if part["size"] > MAX_FORM_FIELD_BYTES:
+                raise ValueError(f"Form field {part['name']} is too long.")
+            part["data"] += data[start:end]
+
+    def on_part_end() -> None:
+        if part["sink"] is not None:
+            part["sink"].close()
+        else:
+            fields[part["name"]] = part["data"].decode("utf-8", "replace")
+
+    parser = MultipartParser(params[b"boundary"], callbacks={
+        "on_part_begin":       on_part_begin,
+        "on_header_field":     on_header_field,
+        "on_header_value":     on_header_value,
+        "on_header_end":       on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data":        on_part_data,
+        "on_part_end":         on_part_end,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except BaseException:   # multipart's parse errors are ValueErrors too
+        if part.get("sink") is not None:
+            part["sink"].close()
+        remove_uploads(files)
+        raise
+    return files, fields
+
+def remove_uploads(files: List[Tuple[str, str]]) -> None:
+    for _, path in files:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
 def embed(text: str, task: str) -> List[float]:
     return genai.embed_content(
         model=GEMINI_EMBED_MODEL,
@@ -56,130 +296,387 @@ def embed(text: str, task: str) -> List[float]:
         task_type=task
     )["embedding"]
 
-def to_pgvector(vec: List[float]) -> str:
-    return "[" + ",".join(f"{x:.6f}" for x in vec) + "]"
+def embed_batch(texts: List[str], task: str) -> List[List[float]]:
+    """Embed many texts with as few Gemini calls as the batch limit allows."""
+    vectors: List[List[float]] = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        chunk = texts[start:start + EMBED_BATCH_SIZE]
+        vectors.extend(genai.embed_content(
+            model=GEMINI_EMBED_MODEL,
+            content=chunk,
+            task_type=task
+        )["embedding"])
+    return vectors
 
-# ─────────────────────  Ingestion endpoint  ───────────────── #
-@app.post("/upload")
-async def upload_pdfs(pdfs: List[UploadFile] = File(...)):
-    for pdf in pdfs:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(await pdf.read())
-            tmp_path = tmp.name
+@lru_cache(maxsize=None)
+def get_llm(model: str = GEMINI_LLM_MODEL) -> genai.GenerativeModel:
+    """One GenerativeModel per model name, shared by every request."""
+    return genai.GenerativeModel(model)
 
-        try:
-            text   = extract_text_from_pdf(tmp_path)
-            vector = embed(text, "retrieval_document")
-
-            payload = {
-                "filename": pdf.filename,
-                "content":  text,
-                "embedding": vector   # JSON list → vector column
-            }
-            log.info("INSERT payload ➜ %s", pformat(payload)[:400])
-            resp = supabase.table("documents").insert(payload).execute()
-            log.info("INSERT result ➜ %s", resp.data)
+# ──────────────────────  Health endpoints  ────────────────── #
+@app.get("/healthz")
+async def liveness():
+    return {"status": "ok"}
 
-        except Exception as e:
-            log.exception("Error ingesting %s", pdf.filename)
-            raise HTTPException(status_code=500, detail=str(e))
 
-        finally:
-            os.remove(tmp_path)
+@app.get("/readyz")
+async def readiness():
+    status = 200 if warmup_state["ready"] else 503
+    return JSONResponse(status_code=status, content=warmup_state)
 
-    return {"message": "PDFs uploaded and processed successfully."}
 
-# ─────────────────────  Retrieval helpers  ────────────────── #
-def parse_embedding(emb: Union[str, List[float]]) -> List[float]:
+@app.get("/stats")
+async def stats():
+    """Vector store size and local index footprint, plus admission lane load."""
+    return {
+        "store":     await scheduler.run(INTERACTIVE, "db", store.stats),
+        "admission": scheduler.stats(),
+    }
+
+# ─────────────────────  Ingestion endpoint  ───────────────── #
+@app.post("/upload", openapi_extra=UPLOAD_OPENAPI)
+async def upload_pdfs(request: Request):
     """
-    Ensure embedding is a list of floats, parsing if it's a string.
+    Ingest the PDFs of a multipart form (`pdfs` file fields, optional
+    `collection` and comma-separated `tags`). The body is parsed as it
+    arrives, see read_upload_form().
     """
-    if isinstance(emb, list):
-        return emb
-    if isinstance(emb, str):
-        # strip brackets and split
+    # shed before the body is received, not after
+    scheduler.admit(BULK, "embed")
+    try:
+        pdfs, form = await read_upload_form(request)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        tag_list = parse_tags(form.get("tags", ""))
+        if not pdfs:
+            raise ValueError("At least one PDF is required.")
+    except ValueError as e:
+        remove_uploads(pdfs)
+        raise HTTPException(status_code=400, detail=str(e))
+    collection = form.get("collection")
+
+    # extract → embed → insert run as concurrent stages joined by bounded
+    # queues, so one file is parsed while the previous one is being embedded
+    # and the one before that is being written.
+    extracted: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+    embedded:  asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+    results:   Dict[int, dict] = {}
+    shed:      List[Overloaded] = []
+
+    def failed(i: int, filename: str, e: Exception) -> None:
+        log.error("Error ingesting %s: %s", filename, e)
+        results[i] = {"filename": filename, "status": "error", "error": str(e)}
+        if isinstance(e, Overloaded):
+            shed.append(e)
+            results[i]["retry_after"] = e.retry_after
+
+    async def extract_stage():
         try:
-            vals = emb.strip('[]').split(',')
-            return [float(x) for x in vals if x]
-        except Exception:
-            log.warning("Failed to parse embedding string: %s", emb[:100])
-    return []
-
-
-def search_supabase(query: str, k: int = 5) -> List[dict]:
-    # 1) Try RPC
-    q_vec     = embed(query, "retrieval_query")
-    q_vec_str = to_pgvector(q_vec)
-
-    log.info("RPC vector literal ➜ %s…", q_vec_str[:100])
-    try:
-        resp = supabase.rpc("match_documents", {
-            "query_embedding": q_vec_str,
-            "match_count":     k
-        }).execute()
-        rows = resp.data or []
-        if rows:
-            log.info("RPC returned %d rows", len(rows))
-            return rows
-        log.warning("RPC returned 0 rows, falling back to manual similarity")
-    except Exception as e:
-        log.error("RPC call failed, falling back: %s", e)
-
-    # 2) Fallback: manual cosine similarity
-    docs = supabase.table("documents") \
-        .select("id, filename, content, embedding") \
-        .execute() \
-        .data or []
-
-    results = []
-    for d in docs:
-        emb_list = parse_embedding(d.get("embedding"))
-        if len(emb_list) != len(q_vec):
-            continue
-        dot      = sum(a*b for a,b in zip(q_vec, emb_list))
-        norm_q   = sum(a*a for a in q_vec) ** 0.5
-        norm_emb = sum(b*b for b in emb_list) ** 0.5
-        sim = dot / (norm_q * norm_emb) if norm_q and norm_emb else 0.0
-        results.append({
-            "id": d.get("id"),
-            "filename": d.get("filename"),
-            "content": d.get("content"),
-            "similarity": sim
-        })
-
-    results.sort(key=lambda x: x["similarity"], reverse=True)
-    log.info("Manual fallback found %d rows (returning top %d)", len(results), k)
-    return results[:k]
-
-
-def generate_answer(query: str) -> str:
-    matches = search_supabase(query)
-    if not matches:
-        return "I couldn't find any relevant documents."
+            for i, (filename, tmp_path) in enumerate(pdfs):
+                try:
+                    text = await asyncio.to_thread(extract_text_from_pdf, tmp_path)
+                except Exception as e:
+                    failed(i, filename, e)
+                    continue
+                finally:
+                    os.remove(tmp_path)
+                await extracted.put((i, filename, text))
+        finally:
+            await extracted.put(None)
+
+    async def embed_stage():
+        try:
+            while (item := await extracted.get()) is not None:
+                i, filename, text = item
+                try:
+                    vector = await scheduler.run(BULK, "embed", embed, text, "retrieval_document")
+                except Exception as e:
+                    failed(i, filename, e)
+                    continue
+                await embedded.put((i, {
+                    "filename": filename,
+                    "content":  text,
+                    "embedding": vector,  # JSON list → vector column
+                    "collection": collection or DEFAULT_COLLECTION,
+                    "tags":     tag_list,
+                }))
+        finally:
+            await embedded.put(None)
+
+    async def insert_stage():
+        while (item := await embedded.get()) is not None:
+            i, payload = item
+            try:
+                log.info("INSERT payload ➜ %s", pformat(payload)[:400])
+                stored = await scheduler.run(BULK, "db", store.insert, payload)
+                log.info("INSERT result ➜ %s", pformat(stored)[:400])
+                results[i] = {"filename": payload["filename"], "status": "success"}
+            except Exception as e:
+                failed(i, payload["filename"], e)
 
+    try:
+        await asyncio.gather(extract_stage(), embed_stage(), insert_stage())
+    finally:
+        remove_uploads(pdfs)   # those extract_stage never reached
+
+    ordered = [results[i] for i in sorted(results)]
+    if shed:
+        # files turned away by admission control are worth retrying later
+        retry_after = max(e.retry_after for e in shed)
+        return JSONResponse(
+            status_code=429,
+            content={"message": "Server busy; some PDFs were not processed.", "results": ordered},
+            headers={"Retry-After": str(retry_after)},
+        )
+    if any(r["status"] == "error" for r in ordered):
+        return JSONResponse(status_code=500, content={"message": "Some PDFs failed to process.", "results": ordered})
+    return {"message": "PDFs uploaded and processed successfully.", "results": ordered}
+
+# ─────────────────────  Retrieval helpers  ────────────────── #
+async def load_local_index(priority: str) -> LocalIndex:
+    """store.local_index() that only takes a DB slot when it must be built."""
+    index = store.local_index(load=False)
+    if index is not None:
+        return index
+    return await scheduler.run(priority, "db", store.local_index)
+
+
+async def search_documents(
+    query: str,
+    k: int = 5,
+    filters: Optional[dict] = None,
+    priority: str = INTERACTIVE,
+) -> List[dict]:
+    q_vec = await scheduler.run(priority, "embed", embed, query, "retrieval_query")
+    if SEARCH_BACKEND == "local":
+        index = await load_local_index(priority)
+        # an exact scan (and each shard's wait on its worker) blocks: keep it
+        # off the event loop, in the same lane as store searches
+        return (await scheduler.run(priority, "db", index.search, [q_vec], k, filters))[0]
+    return await scheduler.run(priority, "db", store.search, q_vec, k, filters)
+
+
+async def generate_answer(query: str, filters: Optional[dict] = None, priority: str = INTERACTIVE) -> str:
+    matches = await search_documents(query, filters=filters, priority=priority)
+    return await answer_from_matches(query, matches, priority)
+
+
+def build_prompt(query: str, matches: List[dict]) -> str:
     context = "\n---\n".join(m["content"][:1800] for m in matches)
-    prompt  = f"""You are an assistant. Use the following documents to answer the question.
+    return f"""You are an assistant. Use the following documents to answer the question.
 
 {context}
 
 Question: {query}
 Answer:"""
 
-    llm    = genai.GenerativeModel(GEMINI_LLM_MODEL)
-    result = llm.generate_content(prompt)
+
+async def answer_from_matches(query: str, matches: List[dict], priority: str = INTERACTIVE) -> str:
+    if not matches:
+        return "I couldn't find any relevant documents."
+
+    prompt = build_prompt(query, matches)
+    result = await scheduler.run(priority, "generate", get_llm().generate_content, prompt)
     return result.text.strip()
 
+# ───────────────────────  Clear endpoint  ─────────────────── #
+@app.post("/clear")
+async def clear_database(request: Request):
+    """
+    Clear the database. An optional JSON body of {"filename": ...} and/or
+    {"collection": ...} limits the delete to matching documents.
+    """
+    try:
+        data = await read_json_object(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    filename   = data.get("filename")
+    collection = data.get("collection")
+
+    try:
+        deleted = await scheduler.run(BULK, "db", store.delete, filename, collection)
+    except Overloaded:
+        raise
+    except Exception as e:
+        log.exception("Error clearing database")
+        return JSONResponse(status_code=500, content={"error": f"Failed to clear database: {e}"})
+
+    return {
+        "message": f"Database cleared successfully. {deleted} documents removed.",
+        "status":  "success",
+        "count":   deleted
+    }
+
 # ───────────────────────  Query endpoint  ─────────────────── #
+# Identical questions asked while one is already being answered share its
+# embed → search → generate run instead of starting their own.
+query_flight = SingleFlight()
+
+
+def query_key(query: str, filters: dict) -> tuple:
+    """Coalescing key: case/whitespace-insensitive question plus its filters."""
+    return " ".join(query.lower().split()), json.dumps(filters, sort_keys=True)
+
+
 @app.post("/query")
 async def query_api(request: Request):
-    data  = await request.json()
+    try:
+        data = await read_json_object(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     query = data.get("query")
     if not query:
         return JSONResponse(status_code=400, content={"error": "Query is required."})
+    try:
+        filters = parse_filters(data.get("filters"))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
 
     try:
-        answer = generate_answer(query)
+        answer = await query_flight.do(
+            query_key(query, filters),
+            lambda: generate_answer(query, filters),
+        )
         return {"answer": answer}
+    except Overloaded:
+        raise
     except Exception as e:
         log.exception("Unhandled error while answering query")
         return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@app.post("/query/batch")
+async def query_batch_api(request: Request):
+    """
+    Answer many questions in one request. Questions are embedded in batched
+    calls, retrieved with blocked matrix products against the local index and
+    answered with bounded concurrency. Results are streamed as NDJSON lines in
+    completion order; each line carries the `index` of its question.
+    """
+    try:
+        data = await read_json_object(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    queries = data.get("queries")
+    if not isinstance(queries, list) or not queries \
+            or not all(isinstance(q, str) and q.strip() for q in queries):
+        return JSONResponse(status_code=400, content={"error": "queries must be a non-empty list of strings."})
+    if len(queries) > MAX_BATCH_QUERIES:
+        return JSONResponse(status_code=400, content={"error": f"At most {MAX_BATCH_QUERIES} queries per batch."})
+    try:
+        k = int(data.get("k", 5))
+    except (TypeError, ValueError):
+        return JSONResponse(status_code=400, content={"error": "k must be an integer."})
+    if not 1 <= k <= MAX_BATCH_K:
+        return JSONResponse(status_code=400, content={"error": f"k must be between 1 and {MAX_BATCH_K}."})
+    try:
+        filters = parse_filters(data.get("filters"))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    try:
+        q_vecs, index = await asyncio.gather(
+            scheduler.run(BULK, "embed", embed_batch, queries, "retrieval_query"),
+            load_local_index(BULK),
+        )
+        # one matrix product per block of questions, in a worker thread
+        matches = await scheduler.run(BULK, "db", index.search, np.asarray(q_vecs, dtype=np.float32), k, filters)
+    except Overloaded:
+        raise
+    except Exception as e:
+        log.exception("Batch retrieval failed")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def answer_one(i: int) -> dict:
+        async with semaphore:
+            try:
+                answer = await answer_from_matches(queries[i], matches[i], BULK)
+                return {"index": i, "query": queries[i], "answer": answer}
+            except Overloaded as e:
+                return {"index": i, "query": queries[i], "error": str(e), "retry_after": e.retry_after}
+            except Exception as e:
+                log.exception("Batch item %d failed", i)
+                return {"index": i, "query": queries[i], "error": str(e)}
+
+    async def stream():
+        tasks = [asyncio.create_task(answer_one(i)) for i in range(len(queries))]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield json.dumps(await done) + "\n"
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+# ───────────────────────  Search endpoint  ────────────────── #
+SEARCH_FIELDS = ("id", "filename", "content", "collection", "tags", "uploaded_at", "similarity")
+search_flight = SingleFlight()
+
+
+def project(match: dict, fields: List[str], query: str, snippet_chars: Optional[int]) -> dict:
+    result = {f: match.get(f) for f in fields}
+    if snippet_chars:
+        result["snippet"], result["highlights"] = make_snippet(match.get("content") or "", query, snippet_chars)
+    return result
+
+
+@app.post("/search")
+async def search_api(request: Request):
+    """
+    Ranked documents for a query, without generating an answer. Body:
+    `query`, optional `filters` (as /query), `limit` (default 10) and
+    `offset` for paging, `fields` to project each result onto, and
+    `snippet_chars` to add a highlighted `snippet` of that length.
+    """
+    try:
+        data = await read_json_object(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    query = data.get("query")
+    if not query:
+        return JSONResponse(status_code=400, content={"error": "Query is required."})
+    try:
+        filters       = parse_filters(data.get("filters"))
+        limit         = int(data.get("limit", 10))
+        offset        = int(data.get("offset", 0))
+        snippet_chars = int(data.get("snippet_chars") or 0)
+    except (TypeError, ValueError) as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    if limit < 1 or offset < 0 or snippet_chars < 0:
+        return JSONResponse(status_code=400, content={"error": "limit must be positive; offset and snippet_chars non-negative."})
+    if offset + limit > MAX_SEARCH_RESULTS:
+        return JSONResponse(status_code=400, content={"error": f"offset + limit may not exceed {MAX_SEARCH_RESULTS}."})
+
+    fields = data.get("fields") or list(SEARCH_FIELDS)
+    if not isinstance(fields, list) or not set(fields) <= set(SEARCH_FIELDS):
+        return JSONResponse(status_code=400, content={"error": f"fields must be a list drawn from {list(SEARCH_FIELDS)}."})
+
+    # one extra row tells whether another page exists; pages of the same
+    # query share a single ranking run when requested concurrently
+    k = offset + limit + 1
+    try:
+        matches = await search_flight.do(
+            (*query_key(query, filters), k),
+            lambda: search_documents(query, k, filters),
+        )
+    except Overloaded:
+        raise
+    except Exception as e:
+        log.exception("Unhandled error while searching")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    page = matches[offset:offset + limit]
+    return {
+        "results":     [project(m, fields, query, snippet_chars) for m in page],
+        "offset":      offset,
+        "limit":       limit,
+        "next_offset": offset + limit if len(matches) > offset + limit else None,
+    }
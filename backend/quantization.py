@@ -0,0 +1,123 @@
+import argparse
+import time
+from typing import Tuple
+
+import numpy as np
+
+# Rows scored per block; bounds the float32 temporaries built while scoring
+# quantized codes to BLOCK_ROWS × dim no matter how large the corpus is.
+BLOCK_ROWS = 16384
+
+# popcount of every byte value, used for Hamming distance on packed bits when
+# numpy (< 2.0) has no bitwise_count
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount_rows(packed: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count") and packed.shape[1] % 8 == 0:
+        words = np.ascontiguousarray(packed).view(np.uint64)
+        return np.bitwise_count(words).sum(axis=1, dtype=np.uint16)
+    return _POPCOUNT[packed].sum(axis=1, dtype=np.uint16)
+
+
+# ─────────────────────────  int8  ─────────────────────────── #
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per-row scalar quantization: row ≈ codes * scale, with codes in
+    [-127, 127]. Returns (codes int8 (n, d), scales float32 (n,)).
+    """
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def int8_scores(queries: np.ndarray, codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """Approximate dot products (n_queries, n_rows) of float queries with int8 rows."""
+    out = np.empty((len(queries), len(codes)), dtype=np.float32)
+    for start in range(0, len(codes), BLOCK_ROWS):
+        block = codes[start:start + BLOCK_ROWS].astype(np.float32)
+        out[:, start:start + len(block)] = (queries @ block.T) * scales[start:start + len(block)]
+    return out
+
+
+# ─────────────────────────  binary  ───────────────────────── #
+def quantize_binary(matrix: np.ndarray) -> np.ndarray:
+    """1-bit sign quantization, packed 8 dims per byte: (n, ceil(d / 8)) uint8."""
+    return np.packbits(matrix > 0, axis=1)
+
+
+def hamming_distances(query_bits: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """Hamming distances (n_queries, n_rows) between packed sign codes."""
+    out = np.empty((len(query_bits), len(codes)), dtype=np.uint16)
+    for start in range(0, len(codes), BLOCK_ROWS):
+        block = codes[start:start + BLOCK_ROWS]
+        for i, q in enumerate(query_bits):
+            out[i, start:start + len(block)] = _popcount_rows(np.bitwise_xor(block, q))
+    return out
+
+
+# ─────────────────────  shortlist helpers  ────────────────── #
+def shortlist(scores: np.ndarray, n: int, largest: bool = True) -> np.ndarray:
+    """Unordered indices of the best `n` entries of each row of `scores`."""
+    n = min(n, scores.shape[1])
+    keyed = -scores if largest else scores
+    return np.argpartition(keyed, n - 1, axis=1)[:, :n]
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    """Mean fraction of each row of `truth` that appears in the matching row of `found`."""
+    hits = [len(np.intersect1d(f, t)) / len(t) for f, t in zip(found, truth)]
+    return float(np.mean(hits))
+
+
+# ───────────────────────  benchmark CLI  ──────────────────── #
+def synthetic_corpus(n: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels  = rng.integers(0, clusters, n)
+    data    = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memory and recall@k of quantized search vs exact cosine.")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--oversample", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng     = np.random.default_rng(args.seed)
+    corpus  = synthetic_corpus(args.docs + args.queries, args.dim, 64, rng)
+    queries, corpus = corpus[:args.queries], corpus[args.queries:]
+
+    exact = corpus @ queries.T
+    truth = np.argsort(-exact.T, axis=1)[:, :args.k]
+    n_candidates = args.k * args.oversample
+
+    int8_codes, int8_scale = quantize_int8(corpus)
+    bits = quantize_binary(corpus)
+    variants = {
+        "int8":   (int8_codes.nbytes + int8_scale.nbytes,
+                   lambda: shortlist(int8_scores(queries, int8_codes, int8_scale), n_candidates)),
+        "binary": (bits.nbytes,
+                   lambda: shortlist(hamming_distances(quantize_binary(queries), bits), n_candidates, largest=False)),
+    }
+
+    print(f"{args.docs} docs × {args.dim} dims, {args.queries} queries, k={args.k}, shortlist={n_candidates}")
+    print(f"{'variant':<8} {'bytes':>12} {'saving':>7} {'shortlist recall':>17} {'recall@k':>9} {'ms/query':>9}")
+    print(f"{'float32':<8} {corpus.nbytes:>12,} {'1.0x':>7} {'':>17} {1.0:>9.3f}")
+    for name, (nbytes, run) in variants.items():
+        started = time.perf_counter()
+        candidates = run()
+        rescored = np.einsum("qcd,qd->qc", corpus[candidates], queries)
+        top = np.take_along_axis(candidates, np.argsort(-rescored, axis=1)[:, :args.k], axis=1)
+        elapsed = (time.perf_counter() - started) * 1000 / args.queries
+        print(f"{name:<8} {nbytes:>12,} {corpus.nbytes / nbytes:>6.1f}x "
+              f"{recall_at_k(candidates, truth):>17.3f} {recall_at_k(top, truth):>9.3f} {elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
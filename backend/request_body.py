@@ -0,0 +1,17 @@
+import json
+
+from fastapi import Request
+
+
+async def read_json_object(request: Request) -> dict:
+    """The request body as a JSON object ({} when empty); ValueError otherwise."""
+    body = await request.body()
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise ValueError("Request body must be valid JSON.") from None
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object.")
+    return data
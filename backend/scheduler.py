@@ -0,0 +1,132 @@
+import math
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+INTERACTIVE = "interactive"
+BULK        = "bulk"
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing when a lane is saturated; maps to HTTP 429."""
+
+    def __init__(self, priority: str, resource: str, retry_after: int):
+        super().__init__(f"{priority} {resource} capacity exhausted, retry in {retry_after}s")
+        self.priority    = priority
+        self.resource    = resource
+        self.retry_after = retry_after
+
+
+class _Lane:
+    """Concurrency cap plus bounded wait queue for one (priority, resource) pair."""
+
+    def __init__(self, limit: int, max_waiting: int, max_wait: float):
+        self.limit       = limit
+        self.max_waiting = max_waiting
+        self.max_wait    = max_wait
+        self.active      = 0
+        self.waiting     = 0
+        self.avg_service = 1.0   # EWMA of seconds per call, feeds Retry-After
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created on first use so it binds to the server's event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    @property
+    def saturated(self) -> bool:
+        return self.active >= self.limit and self.waiting >= self.max_waiting
+
+    def retry_after(self) -> int:
+        backlog = (self.waiting + 1) / self.limit
+        return max(1, math.ceil(backlog * self.avg_service))
+
+    def observe(self, seconds: float) -> None:
+        self.avg_service = 0.8 * self.avg_service + 0.2 * seconds
+
+
+class AdmissionController:
+    """
+    Front door for upstream calls (Gemini embed/generate, Supabase). Each
+    priority class gets its own per-resource concurrency caps, so a burst of
+    bulk work can never occupy the slots interactive requests rely on. When a
+    lane's queue is full, or a caller waits longer than the lane allows, the
+    call fails fast with `Overloaded` rather than piling up latency.
+
+    Blocking calls run on a thread pool per priority class, sized to that
+    class's lanes, so admitted interactive calls never wait for a thread
+    behind bulk work in a shared executor.
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, Tuple[int, int, float]]]):
+        """`limits[priority][resource] = (concurrency, max_waiting, max_wait_seconds)`"""
+        self._lanes = {
+            (priority, resource): _Lane(*spec)
+            for priority, resources in limits.items()
+            for resource, spec in resources.items()
+        }
+        self._executors = {
+            priority: ThreadPoolExecutor(
+                max_workers=sum(spec[0] for spec in resources.values()),
+                thread_name_prefix=f"{priority}-lane",
+            )
+            for priority, resources in limits.items()
+        }
+
+    def _lane(self, priority: str, resource: str) -> _Lane:
+        try:
+            return self._lanes[(priority, resource)]
+        except KeyError:
+            raise ValueError(f"No admission lane for {priority}/{resource}") from None
+
+    def admit(self, priority: str, resource: str) -> None:
+        """Raise `Overloaded` now if a call on this lane would be rejected."""
+        lane = self._lane(priority, resource)
+        if lane.saturated:
+            raise Overloaded(priority, resource, lane.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, priority: str, resource: str) -> AsyncIterator[None]:
+        lane = self._lane(priority, resource)
+        if lane.saturated:
+            raise Overloaded(priority, resource, lane.retry_after())
+
+        lane.waiting += 1
+        try:
+            await asyncio.wait_for(lane.semaphore.acquire(), lane.max_wait)
+        except asyncio.TimeoutError:
+            raise Overloaded(priority, resource, lane.retry_after()) from None
+        finally:
+            lane.waiting -= 1
+
+        lane.active += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            lane.active -= 1
+            lane.observe(time.monotonic() - started)
+            lane.semaphore.release()
+
+    async def run(self, priority: str, resource: str, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run blocking `fn(*args)` on the priority's thread pool once a slot is free."""
+        async with self.slot(priority, resource):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executors[priority], functools.partial(fn, *args))
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            f"{priority}/{resource}": {
+                "active":      lane.active,
+                "waiting":     lane.waiting,
+                "limit":       lane.limit,
+                "avg_service": round(lane.avg_service, 3),
+            }
+            for (priority, resource), lane in self._lanes.items()
+        }
@@ -0,0 +1,118 @@
+import weakref
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import numpy as np
+
+# Per worker process: read-only views of the corpus matrices it has been
+# asked to search, by shared memory name. The newest two stay mapped, so a
+# search still running on an index that was just compacted away keeps
+# working while the replacement's matrix is attached.
+_MAPPED: "OrderedDict[str, Tuple[shared_memory.SharedMemory, np.ndarray]]" = OrderedDict()
+MAPPED_MATRICES = 2
+
+
+def _limit_threads() -> None:
+    # the pool already provides the parallelism; a multi-threaded BLAS in
+    # every worker would only oversubscribe the cores
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+
+
+def _matrix(name: str, shape: Tuple[int, int]) -> np.ndarray:
+    if name in _MAPPED:
+        _MAPPED.move_to_end(name)
+        return _MAPPED[name][1]
+    shm = shared_memory.SharedMemory(name=name)
+    matrix = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    matrix.flags.writeable = False
+    _MAPPED[name] = (shm, matrix)
+    while len(_MAPPED) > MAPPED_MATRICES:
+        old = _MAPPED.popitem(last=False)[1][0]   # drops our view of it too
+        try:
+            old.close()
+        except BufferError:
+            pass  # a view is still alive; the mapping goes away with it
+    return matrix
+
+
+def _search_shard(
+    name: str, shape: Tuple[int, int], start: int, stop: int, queries: np.ndarray, k: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k (global row indices, scores) of rows [start, stop) for each query."""
+    scores = queries @ _matrix(name, shape)[start:stop].T
+    k = min(k, stop - start)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return top + start, np.take_along_axis(scores, top, axis=1)
+
+
+@lru_cache(maxsize=None)
+def worker_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    One process pool per worker count, shared by every ShardedSearcher in
+    this process: rebuilding or compacting an index reuses the running
+    workers instead of spawning new ones.
+    """
+    # spawn, not fork: the API process runs threads (uvicorn, to_thread)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_limit_threads,
+    )
+
+
+def _release(shm: shared_memory.SharedMemory) -> None:
+    try:
+        shm.close()
+    except BufferError:
+        pass  # a numpy view still exists; the mapping goes away with it
+    shm.unlink()
+
+
+class ShardedSearcher:
+    """
+    Exact inner-product search with the corpus matrix split into row shards,
+    each scored by a separate worker process. The matrix is placed in shared
+    memory once, so workers attach to it instead of receiving a copy, and
+    only the queries and each shard's top-k travel between processes. The
+    worker processes themselves come from worker_pool() and outlive the
+    searcher; close() (or garbage collection) frees only the shared matrix.
+    """
+
+    def __init__(self, matrix: np.ndarray, workers: int):
+        n_rows, dim = matrix.shape
+        self._shm = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+        self.matrix = np.ndarray((n_rows, dim), dtype=np.float32, buffer=self._shm.buf)
+        self.matrix[:] = matrix
+
+        bounds = np.linspace(0, n_rows, workers + 1).astype(int)
+        self._shards = [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+        self._pool   = worker_pool(workers)
+        self._finalizer = weakref.finalize(self, _release, self._shm)
+        # start and attach every worker now rather than on the first query
+        if n_rows:
+            self.search(np.zeros((1, dim), dtype=np.float32), 1)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(indices, scores), each (n_queries, k) and sorted by descending score."""
+        name, shape = self._shm.name, self.matrix.shape
+        futures = [self._pool.submit(_search_shard, name, shape, a, b, queries, k) for a, b in self._shards]
+        parts = [f.result() for f in futures]
+        indices = np.concatenate([p[0] for p in parts], axis=1)
+        scores  = np.concatenate([p[1] for p in parts], axis=1)
+
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+    def __len__(self) -> int:
+        return len(self._shards)
+
+    def close(self) -> None:
+        self._finalizer()
@@ -0,0 +1,251 @@
+"""
+Export the `documents` table to a snapshot directory and load it back without
+calling Gemini.
+
+    python snapshot.py export SNAPSHOT_DIR [--collection C] [--format jsonl|parquet]
+    python snapshot.py import SNAPSHOT_DIR [--batch-size 500] [--keep-ids]
+
+Exports always read the Supabase table. Imports go through the vector store
+selected by VECTOR_STORE, so a snapshot of the table can also seed the
+embedded SQLite store (without --keep-ids when the table's ids are UUIDs).
+
+A snapshot holds
+    manifest.json    row count, dimension, embedding model, row format
+    rows.jsonl       id, filename, content, collection, tags, uploaded_at, updated_at
+      or rows.parquet  (parquet needs pyarrow)
+    embeddings.npy   float32 matrix, row i belongs to row i of the rows file
+
+Point LOCAL_INDEX_SNAPSHOT at a snapshot directory to build the API's local
+index from it instead of scanning the table.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from local_index import parse_embedding
+from vector_store import to_pgvector
+
+GEMINI_EMBED_MODEL = "models/text-embedding-004"
+EMBED_DIM          = 768
+PAGE_SIZE          = 1000
+ROW_COLUMNS        = ["id", "filename", "content", "collection", "tags", "uploaded_at", "updated_at"]
+COPY_CHUNK_ROWS    = 65536
+
+
+def get_client():
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    load_dotenv()
+    return create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_KEY"])
+
+
+def get_store():
+    from dotenv import load_dotenv
+    from vector_store import store_from_env
+
+    load_dotenv()
+    return store_from_env(EMBED_DIM)
+
+
+# ─────────────────────────  reading  ──────────────────────── #
+def read_manifest(path: str) -> dict:
+    with open(os.path.join(path, "manifest.json")) as f:
+        return json.load(f)
+
+
+def iter_rows(path: str, manifest: dict) -> Iterator[dict]:
+    if manifest["rows_format"] == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(os.path.join(path, "rows.parquet")).iter_batches():
+            yield from batch.to_pylist()
+    else:
+        with open(os.path.join(path, "rows.jsonl")) as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def read_snapshot(path: str) -> Tuple[List[dict], np.ndarray]:
+    """Rows plus a read-only memory-mapped float32 embedding matrix."""
+    manifest = read_manifest(path)
+    rows     = list(iter_rows(path, manifest))
+    matrix   = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+    if len(rows) != len(matrix):
+        raise ValueError(f"Snapshot {path} has {len(rows)} rows but {len(matrix)} embeddings")
+    return rows, matrix
+
+
+# ─────────────────────────  export  ───────────────────────── #
+class _RowWriter:
+    def __init__(self, path: str, fmt: str):
+        self.fmt = fmt
+        if fmt == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                sys.exit("--format parquet requires pyarrow (pip install pyarrow)")
+            self._path   = os.path.join(path, "rows.parquet")
+            self._writer = None
+        else:
+            self._file = open(os.path.join(path, "rows.jsonl"), "w")
+
+    def write(self, rows: List[dict]) -> None:
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # ids may be bigint or uuid depending on the schema; store as text
+            rows  = [{**r, "id": str(r["id"])} for r in rows]
+            table = pa.Table.from_pylist(rows, schema=self._schema(pa))
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self._path, table.schema)
+            self._writer.write_table(table)
+        else:
+            for row in rows:
+                self._file.write(json.dumps(row) + "\n")
+
+    @staticmethod
+    def _schema(pa):
+        return pa.schema([
+            ("id", pa.string()), ("filename", pa.string()), ("content", pa.string()),
+            ("collection", pa.string()), ("tags", pa.list_(pa.string())), ("uploaded_at", pa.string()),
+            ("updated_at", pa.string()),
+        ])
+
+    def close(self) -> None:
+        if self.fmt == "parquet":
+            if self._writer is not None:
+                self._writer.close()
+        else:
+            self._file.close()
+
+
+def export_snapshot(path: str, collection: Optional[str] = None, fmt: str = "jsonl", dim: int = EMBED_DIM) -> int:
+    supabase = get_client()
+    os.makedirs(path, exist_ok=True)
+    rows_out = _RowWriter(path, fmt)
+
+    # embeddings are streamed to a raw file first because the row count is
+    # only known at the end, then wrapped into a .npy
+    count = 0
+    with tempfile.TemporaryFile(dir=path) as raw:
+        last_id = None
+        while True:
+            select = supabase.table("documents") \
+                .select(", ".join(ROW_COLUMNS + ["embedding"])) \
+                .order("id") \
+                .limit(PAGE_SIZE)
+            if collection:
+                select = select.eq("collection", collection)
+            if last_id is not None:
+                select = select.gt("id", last_id)
+            page = select.execute().data or []
+            if not page:
+                break
+            last_id = page[-1]["id"]
+
+            kept = []
+            for d in page:
+                emb = parse_embedding(d.get("embedding"))
+                if len(emb) != dim:
+                    print(f"Skipping document {d.get('id')}: embedding has {len(emb)} dims")
+                    continue
+                raw.write(np.asarray(emb, dtype=np.float32).tobytes())
+                kept.append({c: d.get(c) for c in ROW_COLUMNS})
+            rows_out.write(kept)
+            count += len(kept)
+            print(f"Exported {count} documents")
+
+        rows_out.close()
+        raw.seek(0)
+        matrix = np.lib.format.open_memmap(
+            os.path.join(path, "embeddings.npy"), mode="w+", dtype=np.float32, shape=(count, dim)
+        )
+        for start in range(0, count, COPY_CHUNK_ROWS):
+            n = min(COPY_CHUNK_ROWS, count - start)
+            matrix[start:start + n] = np.frombuffer(raw.read(n * dim * 4), dtype=np.float32).reshape(n, dim)
+        matrix.flush()
+        del matrix
+
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump({
+            "version":     1,
+            "rows":        count,
+            "dim":         dim,
+            "embed_model": GEMINI_EMBED_MODEL,
+            "collection":  collection,
+            "rows_format": fmt,
+            "created_at":  datetime.now(timezone.utc).isoformat(),
+        }, f, indent=2)
+    return count
+
+
+# ─────────────────────────  import  ───────────────────────── #
+def import_snapshot(path: str, batch_size: int = 500, keep_ids: bool = False) -> int:
+    """
+    Bulk-insert a snapshot through the vector store. With keep_ids rows keep
+    their original ids (the ids must not exist yet, and the SQLite store only
+    takes integer ids); on Supabase reset the id sequence afterwards
+    (SELECT setval(...)) if the column is bigserial.
+    """
+    store    = get_store()
+    manifest = read_manifest(path)
+    if manifest["embed_model"] != GEMINI_EMBED_MODEL:
+        print(f"Warning: snapshot embeddings come from {manifest['embed_model']}, "
+              f"queries use {GEMINI_EMBED_MODEL}")
+    matrix = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+
+    count, batch = 0, []
+
+    def flush() -> None:
+        store.bulk_insert(batch)
+
+    for i, row in enumerate(iter_rows(path, manifest)):
+        payload = {c: row.get(c) for c in ROW_COLUMNS if row.get(c) is not None}
+        payload.pop("updated_at", None)   # set by the store
+        if not keep_ids:
+            payload.pop("id", None)
+        payload["embedding"] = to_pgvector(matrix[i])
+        batch.append(payload)
+        if len(batch) >= batch_size:
+            flush()
+            count += len(batch)
+            batch = []
+            print(f"Imported {count} / {manifest['rows']} documents")
+    if batch:
+        flush()
+        count += len(batch)
+    print(f"Imported {count} documents")
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export/import documents and embeddings snapshots.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    exp = sub.add_parser("export", help="write the documents table to a snapshot directory")
+    exp.add_argument("path")
+    exp.add_argument("--collection", help="only export this collection")
+    exp.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+
+    imp = sub.add_parser("import", help="bulk-load a snapshot into the vector store")
+    imp.add_argument("path")
+    imp.add_argument("--batch-size", type=int, default=500)
+    imp.add_argument("--keep-ids", action="store_true", help="insert with the snapshot's ids")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_snapshot(args.path, args.collection, args.format)
+    else:
+        import_snapshot(args.path, args.batch_size, args.keep_ids)
+
+
+if __name__ == "__main__":
+    main()
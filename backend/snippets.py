@@ -0,0 +1,54 @@
+import re
+from typing import List, Tuple
+
+# words too common to be worth highlighting
+STOPWORDS = frozenset("""
+a an and are as at be by did do does for from has have how i in is it its of on or
+that the their this to was what when where which who why will with you your
+""".split())
+
+
+def query_terms(query: str) -> List[str]:
+    terms = {t for t in re.findall(r"\w+", query.lower()) if len(t) > 1 and t not in STOPWORDS}
+    # longest first so "vectors" wins over "vector" in the alternation
+    return sorted(terms, key=len, reverse=True)
+
+
+def make_snippet(content: str, query: str, width: int = 240) -> Tuple[str, List[Tuple[int, int]]]:
+    """
+    A window of about `width` characters of `content` centred on the densest
+    cluster of query terms, plus the (start, end) offsets of every term match
+    inside the snippet. Offsets rather than inline markup, so clients can
+    render highlights however they like without escaping the text.
+    """
+    content = content or ""
+    terms   = query_terms(query)
+    pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, terms)) + r")\w*", re.IGNORECASE) if terms else None
+    matches = [(m.start(), m.end()) for m in pattern.finditer(content)] if pattern else []
+
+    if len(content) <= width:
+        return content, matches
+
+    # start the window at the match that has the most other matches after it
+    start = 0
+    if matches:
+        best, best_count, j = 0, 0, 0
+        for i, (s, _) in enumerate(matches):
+            j = max(j, i)
+            while j < len(matches) and matches[j][0] < s + width:
+                j += 1
+            if j - i > best_count:
+                best, best_count = i, j - i
+        start = max(0, min(matches[best][0] - width // 4, len(content) - width))
+        # don't cut a word in half
+        while 0 < start < len(content) and not content[start - 1].isspace():
+            start += 1
+    end = min(len(content), start + width)
+    while end < len(content) and not content[end].isspace() and end - start < width + 20:
+        end += 1
+
+    prefix  = "…" if start > 0 else ""
+    suffix  = "…" if end < len(content) else ""
+    snippet = prefix + content[start:end] + suffix
+    shift   = len(prefix) - start
+    return snippet, [(s + shift, e + shift) for s, e in matches if s >= start and e <= end]
@@ -0,0 +1,506 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from change_feed import fetch_changes, latest_tombstone
+from local_index import (
+    LocalIndex, document_row, latest_timestamp, normalize_rows, parse_embedding, parse_timestamp,
+)
+
+log = logging.getLogger("uvicorn.error")
+
+VECTOR_STORES      = ("supabase", "sqlite")
+DOCUMENT_COLUMNS   = "id, filename, content, collection, tags, uploaded_at, updated_at, embedding"
+DEFAULT_COLLECTION = "default"
+FETCH_PAGE_SIZE    = 1000  # PostgREST caps un-ranged selects at 1000 rows
+DELETE_BATCH_SIZE  = 500   # ids per DELETE; keeps request URLs short
+
+
+def to_pgvector(vec: Sequence[float]) -> str:
+    return "[" + ",".join(f"{x:.6f}" for x in vec) + "]"
+
+
+def rpc_filter_params(filters: dict) -> dict:
+    return {
+        "filter_collection": filters.get("collection"),
+        "filter_tags":       filters.get("tags") or None,
+        "uploaded_after":    filters.get("uploaded_after"),
+        "uploaded_before":   filters.get("uploaded_before"),
+    }
+
+
+class VectorStore:
+    """
+    Where documents and their embeddings live. Rows passed to insert() carry
+    filename, content, embedding and optionally collection and tags; search()
+    returns stored rows with a `similarity` score and honours the filters of
+    filters.parse_filters. Every method blocks, so async callers run them in a
+    worker thread.
+
+    Each store also keeps a LocalIndex of its vectors for batched matrix
+    searches; local_index(load=False) returns it only if already built.
+    """
+
+    name = "base"
+
+    def insert(self, row: dict) -> dict:
+        return self.bulk_insert([row])[0]
+
+    def bulk_insert(self, rows: List[dict]) -> List[dict]:
+        """
+        Store rows and return them as stored (id and timestamps filled in).
+        A row's own id and uploaded_at are kept if set, as for snapshot imports.
+        """
+        raise NotImplementedError
+
+    def search(self, q_vec: Sequence[float], k: int = 5, filters: Optional[dict] = None) -> List[dict]:
+        raise NotImplementedError
+
+    def delete(self, filename: Optional[str] = None, collection: Optional[str] = None) -> int:
+        """Delete matching documents (all of them without arguments); return how many."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+    def local_index(self, load: bool = True) -> Optional[LocalIndex]:
+        raise NotImplementedError
+
+    def sync(self) -> None:
+        """Pick up writes made by other processes; a no-op where there are none."""
+
+
+# ─────────────────────────  Supabase  ─────────────────────── #
+class SupabaseStore(VectorStore):
+    """
+    The `documents` table in Supabase, searched with the `match_documents`
+    RPC. The local index is a normalised float32 copy of the table used when
+    the RPC fails or returns nothing. It is built lazily (from `snapshot` the
+    first time, if given), updated in place by this store's own writes and by
+    sync() for everyone else's, and only dropped after a full clear.
+    """
+
+    name = "supabase"
+
+    def __init__(
+        self,
+        client,
+        dim: int,
+        index_options: Optional[dict] = None,
+        snapshot: Optional[str] = None,
+        sync_max_changes: int = 5000,
+    ):
+        self.client           = client
+        self.dim              = dim
+        self.index_options    = index_options or {}
+        self.sync_max_changes = sync_max_changes
+        self._snapshot        = snapshot if snapshot and self._whole_table(snapshot) else None
+        self._index: Optional[LocalIndex] = None
+        self._index_lock      = threading.Lock()
+
+    @classmethod
+    def from_env(cls, dim: int, **options) -> "SupabaseStore":
+        from supabase import create_client
+
+        url, key = os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY")
+        if not url or not key:
+            raise ValueError("VECTOR_STORE=supabase needs SUPABASE_URL and SUPABASE_SERVICE_KEY.")
+        return cls(create_client(url, key), dim, **options)
+
+    @staticmethod
+    def _whole_table(snapshot: str) -> bool:
+        """
+        Only a full export can stand in for the table: sync() only adds rows
+        changed after the snapshot, so a collection's export would hide the
+        other collections from the local index for good.
+        """
+        from snapshot import read_manifest
+
+        collection = read_manifest(snapshot).get("collection")
+        if collection:
+            log.warning("Ignoring LOCAL_INDEX_SNAPSHOT %s: it only holds collection %r", snapshot, collection)
+        return not collection
+
+    def bulk_insert(self, rows: List[dict]) -> List[dict]:
+        stored = self.client.table("documents").insert(rows).execute().data or []
+        self._apply(upserts=stored)
+        return stored
+
+    def search(self, q_vec: Sequence[float], k: int = 5, filters: Optional[dict] = None) -> List[dict]:
+        filters = filters or {}
+
+        # 1) Try RPC; filters are applied inside match_documents' vector scan
+        q_vec_str = to_pgvector(q_vec)
+        log.info("RPC vector literal ➜ %s…", q_vec_str[:100])
+        try:
+            rows = self.client.rpc("match_documents", {
+                "query_embedding": q_vec_str,
+                "match_count":     k,
+                **rpc_filter_params(filters),
+            }).execute().data or []
+            if rows:
+                log.info("RPC returned %d rows", len(rows))
+                return rows
+            log.warning("RPC returned 0 rows, falling back to manual similarity")
+        except Exception as e:
+            log.error("RPC call failed, falling back: %s", e)
+
+        # 2) Fallback: manual cosine similarity over the local index
+        results = self.local_index().search([q_vec], k, filters)[0]
+        log.info("Manual fallback returned %d rows", len(results))
+        return results
+
+    def delete(self, filename: Optional[str] = None, collection: Optional[str] = None) -> int:
+        """
+        An unscoped delete truncates the table server-side via the
+        `clear_documents` function. Scoped deletes (and the fallback when that
+        function is missing) walk the matching ids in keyset order and delete
+        them in fixed-size batches, so no request grows with the table. Each
+        batch is removed from the local index as it goes; a truncate drops it.
+        """
+        if not filename and not collection:
+            try:
+                resp = self.client.rpc("clear_documents", {}).execute()
+                self.invalidate_local_index()
+                return int(resp.data or 0)
+            except Exception as e:
+                log.warning("clear_documents RPC failed, falling back to batched deletes: %s", e)
+
+        deleted = 0
+        last_id = None
+        while True:
+            select = self.client.table("documents").select("id").order("id").limit(DELETE_BATCH_SIZE)
+            if filename:
+                select = select.eq("filename", filename)
+            if collection:
+                select = select.eq("collection", collection)
+            if last_id is not None:
+                select = select.gt("id", last_id)
+
+            ids = [row["id"] for row in select.execute().data or []]
+            if not ids:
+                return deleted
+
+            self.client.table("documents").delete().in_("id", ids).execute()
+            self._apply(deleted_ids=ids)
+            deleted += len(ids)
+            last_id = ids[-1]
+            log.info("Deleted %d documents so far", deleted)
+
+    def stats(self) -> dict:
+        resp  = self.client.table("documents").select("id", count="exact").limit(1).execute()
+        index = self._index
+        return {
+            "backend":     self.name,
+            "documents":   resp.count,
+            "local_index": index.memory_stats() if index is not None else None,
+        }
+
+    # ───────────────────────  local index  ─────────────────────── #
+    def fetch_all_documents(self, columns: str = DOCUMENT_COLUMNS) -> List[dict]:
+        """
+        Every row, paged by id (keyset, not offset) so a concurrent delete or
+        insert cannot shift rows between pages and skip or repeat them.
+        """
+        docs: List[dict] = []
+        last_id = None
+        while True:
+            select = self.client.table("documents").select(columns).order("id").limit(FETCH_PAGE_SIZE)
+            if last_id is not None:
+                select = select.gt("id", last_id)
+            page = select.execute().data or []
+            docs.extend(page)
+            if len(page) < FETCH_PAGE_SIZE:
+                return docs
+            last_id = page[-1]["id"]
+
+    def local_index(self, load: bool = True) -> Optional[LocalIndex]:
+        if self._index is not None or not load:
+            return self._index
+        with self._index_lock:
+            if self._index is None:
+                if self._snapshot:
+                    snapshot, self._snapshot = self._snapshot, None
+                    index = LocalIndex.from_snapshot(snapshot, **self.index_options)
+                    log.info("Local index loaded from snapshot %s", snapshot)
+                else:
+                    # changes before the latest tombstone are reflected in the scan
+                    since_tombstone = self._latest_tombstone()
+                    index = LocalIndex.from_documents(self.fetch_all_documents(), self.dim, **self.index_options)
+                    index.watermark = latest_timestamp(index.watermark, since_tombstone)
+                    index.base_watermark = index.watermark
+                log.info("Local index loaded ➜ %s", index.memory_stats())
+                self._index = index
+            return self._index
+
+    def invalidate_local_index(self) -> None:
+        with self._index_lock:
+            self._index = None
+
+    def _latest_tombstone(self) -> Optional[str]:
+        try:
+            return latest_tombstone(self.client)
+        except Exception as e:
+            log.warning("Could not read document_tombstones, change-feed sync disabled: %s", e)
+            return None
+
+    def _apply(self, upserts: Iterable[dict] = (), deleted_ids: Iterable = ()) -> None:
+        """Reflect this process's own writes without waiting for the next sync."""
+        index = self._index
+        if index is not None:
+            index.apply_changes(upserts, deleted_ids)
+
+    def sync(self) -> None:
+        """
+        Pull rows changed and ids deleted since the index's watermark and apply
+        them in place. A TRUNCATE newer than the index, or more changes than
+        sync_max_changes, drops the index so the next search reloads it.
+        """
+        index = self._index
+        if index is None:
+            return
+
+        changes = fetch_changes(
+            self.client, index.watermark, DOCUMENT_COLUMNS, FETCH_PAGE_SIZE, self.sync_max_changes
+        )
+        truncated = changes and changes["truncated_at"] and (
+            index.base_watermark is None
+            or parse_timestamp(changes["truncated_at"]) > parse_timestamp(index.base_watermark)
+        )
+        if changes is None or truncated:
+            log.info("Local index sync: %s, reloading", "table truncated" if truncated else "too many changes")
+            self.invalidate_local_index()
+            return
+
+        if changes["upserts"] or changes["deleted_ids"]:
+            index.apply_changes(changes["upserts"], changes["deleted_ids"])
+            log.info("Local index sync: %d upserts, %d deletes", len(changes["upserts"]), len(changes["deleted_ids"]))
+        index.watermark = changes["watermark"]
+
+        if index.needs_compaction:
+            compacted = index.compacted()
+            with self._index_lock:
+                if self._index is index:
+                    self._index = compacted
+
+
+# ─────────────────────  embedded SQLite  ──────────────────── #
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename    TEXT,
+    content     TEXT,
+    collection  TEXT NOT NULL DEFAULT 'default',
+    tags        TEXT NOT NULL DEFAULT '[]',
+    uploaded_at TEXT NOT NULL,
+    updated_at  TEXT NOT NULL,
+    vector_row  INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_collection_idx ON documents (collection);
+CREATE INDEX IF NOT EXISTS documents_filename_idx ON documents (filename);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+COPY_CHUNK_ROWS = 65536
+
+
+class SQLiteStore(VectorStore):
+    """
+    Embedded single-node store for one-box deployments: rows in a SQLite
+    database, L2-normalised embeddings appended to a float32 file that is
+    memory-mapped back, and every search answered in-process by a LocalIndex
+    over that mapping. New rows go to the index's delta segments and deleted
+    ones are masked; once enough have piled up the index is reloaded, which
+    also rewrites the vector file without the deleted rows.
+
+    The directory must be owned by a single process (one uvicorn worker).
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, dim: int, index_options: Optional[dict] = None):
+        os.makedirs(path, exist_ok=True)
+        self.path          = path
+        self.dim           = dim
+        self.index_options = index_options or {}
+        self._lock         = threading.RLock()
+
+        self._db = sqlite3.connect(os.path.join(path, "documents.db"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SQLITE_SCHEMA)
+        with self._db:
+            self._db.execute("INSERT OR IGNORE INTO meta VALUES ('dim', ?)", (str(dim),))
+            self._db.execute("INSERT OR IGNORE INTO meta VALUES ('vectors', 'vectors-0.f32')")
+        stored_dim = int(self._meta("dim"))
+        if stored_dim != dim:
+            raise ValueError(f"{path} holds {stored_dim}-dim embeddings, expected {dim}")
+
+        self._index = self._load()
+        log.info("SQLite store %s loaded ➜ %s", path, self._index.memory_stats())
+
+    def _meta(self, key: str) -> str:
+        return self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, self._meta("vectors"))
+
+    def _vectors(self) -> np.ndarray:
+        """Read-only mapping of the vector file (rows beyond a torn append are cut off)."""
+        path = self._vectors_path
+        n = os.path.getsize(path) // (self.dim * 4) if os.path.exists(path) else 0
+        if not n:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(path, dtype=np.float32, mode="r", shape=(n, self.dim))
+
+    @staticmethod
+    def _document(r: sqlite3.Row) -> dict:
+        return document_row({**dict(r), "tags": json.loads(r["tags"])})
+
+    def _load(self) -> LocalIndex:
+        with self._lock:
+            records = self._db.execute("SELECT * FROM documents ORDER BY id").fetchall()
+            slots   = np.fromiter((r["vector_row"] for r in records), dtype=np.int64, count=len(records))
+            vectors = self._vectors()
+            if len(vectors) != len(slots) or not np.array_equal(slots, np.arange(len(slots))):
+                vectors = self._rewrite_vectors(records, vectors, slots)
+            return LocalIndex([self._document(r) for r in records], vectors[:len(records)], **self.index_options)
+
+    def _rewrite_vectors(self, records: List[sqlite3.Row], vectors: np.ndarray, slots: np.ndarray) -> np.ndarray:
+        """
+        Copy the live vectors, in row order, into a new generation of the
+        vector file. The switch to it is one SQLite transaction, so a crash
+        leaves either the old file and slots or the new ones.
+        """
+        old_path   = self._vectors_path
+        generation = int(self._meta("vectors")[len("vectors-"):-len(".f32")])
+        new_name   = f"vectors-{generation + 1}.f32"
+        with open(os.path.join(self.path, new_name), "wb") as f:
+            for start in range(0, len(slots), COPY_CHUNK_ROWS):
+                f.write(np.ascontiguousarray(vectors[slots[start:start + COPY_CHUNK_ROWS]]).tobytes())
+        with self._db:
+            self._db.executemany(
+                "UPDATE documents SET vector_row = ? WHERE id = ?",
+                ((i, r["id"]) for i, r in enumerate(records)),
+            )
+            self._db.execute("UPDATE meta SET value = ? WHERE key = 'vectors'", (new_name,))
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass  # never written, or still mapped on a platform that forbids it
+        log.info("SQLite store: vector file compacted to %d rows", len(slots))
+        return self._vectors()
+
+    def bulk_insert(self, rows: List[dict]) -> List[dict]:
+        vectors = []
+        for r in rows:
+            if r.get("id") is not None and not str(r["id"]).isdigit():
+                # e.g. UUIDs from a Supabase snapshot imported with --keep-ids
+                raise ValueError(f"SQLite store ids are integers, got {r['id']!r}; "
+                                 "import without --keep-ids to assign new ones")
+            emb = parse_embedding(r.get("embedding"))
+            if len(emb) != self.dim:
+                raise ValueError(f"Embedding for {r.get('filename')} has {len(emb)} dims, expected {self.dim}")
+            vectors.append(emb)
+        matrix = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(len(vectors), self.dim))
+        now = datetime.now(timezone.utc).isoformat()
+
+        with self._lock:
+            # vectors first: a crash before the rows commit leaves only an
+            # unreferenced tail, which the next compaction drops
+            path  = self._vectors_path
+            start = os.path.getsize(path) // (self.dim * 4) if os.path.exists(path) else 0
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.seek(start * self.dim * 4)
+                f.write(matrix.tobytes())
+                f.truncate()
+
+            stored = []
+            with self._db:
+                for i, r in enumerate(rows):
+                    doc = {
+                        "filename":    r.get("filename"),
+                        "content":     r.get("content"),
+                        "collection":  r.get("collection") or DEFAULT_COLLECTION,
+                        "tags":        list(r.get("tags") or []),
+                        "uploaded_at": r.get("uploaded_at") or now,
+                        "updated_at":  now,
+                    }
+                    # a NULL id lets SQLite assign the next one
+                    cur = self._db.execute(
+                        "INSERT INTO documents (id, filename, content, collection, tags, uploaded_at, updated_at, vector_row)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (r.get("id"), doc["filename"], doc["content"], doc["collection"], json.dumps(doc["tags"]),
+                         doc["uploaded_at"], now, start + i),
+                    )
+                    stored.append(document_row({**doc, "id": cur.lastrowid}))
+
+            self._index.apply_changes([{**d, "embedding": v} for d, v in zip(stored, matrix.tolist())])
+            self._compact_if_needed()
+        return stored
+
+    def search(self, q_vec: Sequence[float], k: int = 5, filters: Optional[dict] = None) -> List[dict]:
+        return self._index.search([q_vec], k, filters)[0]
+
+    def delete(self, filename: Optional[str] = None, collection: Optional[str] = None) -> int:
+        clauses, params = [], []
+        if filename:
+            clauses.append("filename = ?")
+            params.append(filename)
+        if collection:
+            clauses.append("collection = ?")
+            params.append(collection)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+
+        with self._lock:
+            ids = [r[0] for r in self._db.execute("SELECT id FROM documents" + where, params)]
+            if not ids:
+                return 0
+            with self._db:
+                self._db.execute("DELETE FROM documents" + where, params)
+            if clauses:
+                self._index.apply_changes((), ids)
+                self._compact_if_needed()
+            else:
+                self._index = self._load()
+        return len(ids)
+
+    def _compact_if_needed(self) -> None:
+        if self._index.needs_compaction:
+            self._index = self._load()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._db.execute("SELECT count(*) FROM documents").fetchone()[0]
+            path  = self._vectors_path
+        return {
+            "backend":       self.name,
+            "documents":     count,
+            "path":          self.path,
+            "vectors_bytes": os.path.getsize(path) if os.path.exists(path) else 0,
+            "local_index":   self._index.memory_stats(),
+        }
+
+    def local_index(self, load: bool = True) -> Optional[LocalIndex]:
+        return self._index
+
+
+def store_from_env(dim: int, **options) -> VectorStore:
+    """
+    The store selected by VECTOR_STORE: "supabase" (default) or "sqlite",
+    the latter kept under VECTOR_STORE_PATH. `options` go to the store's
+    constructor; the SQLite store only takes `index_options`.
+    """
+    kind = os.getenv("VECTOR_STORE", "supabase")
+    if kind == "supabase":
+        return SupabaseStore.from_env(dim, **options)
+    if kind == "sqlite":
+        return SQLiteStore(os.getenv("VECTOR_STORE_PATH", "./vector_store"), dim, options.get("index_options"))
+    raise ValueError(f"VECTOR_STORE must be one of {VECTOR_STORES}, got {kind!r}")
@@ -1,31 +1,40 @@
 import os
+import sys
 import tempfile
-from typing import List, Union
-from fastapi import FastAPI, File, UploadFile, Request, HTTPException
+from typing import List, Optional
+from fastapi import FastAPI, File, Form, UploadFile, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import fitz  # PyMuPDF
 import google.generativeai as genai
-from supabase import create_client, Client
 from dotenv import load_dotenv
 
+# Share the vector store implementations with the backend
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from filters import parse_filters, parse_tags
+from request_body import read_json_object
+from vector_store import DEFAULT_COLLECTION, store_from_env
+
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase and Gemini
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+# Initialize Gemini and the vector store (VECTOR_STORE, default supabase)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-if not all([SUPABASE_URL, SUPABASE_SERVICE_KEY, GEMINI_API_KEY]):
+if not GEMINI_API_KEY:
     raise ValueError("Missing required environment variables. Please check your environment variables.")
 
 genai.configure(api_key=GEMINI_API_KEY)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
 # Constants
 GEMINI_LLM_MODEL = "gemini-2.5-flash-preview-04-17"
 GEMINI_EMBED_MODEL = "models/text-embedding-004"
+EMBED_DIM = 768
+
+store = store_from_env(EMBED_DIM)
+
+# One GenerativeModel for the process, shared by every request
+llm = genai.GenerativeModel(GEMINI_LLM_MODEL)
 
 # Create FastAPI app
 app = FastAPI()
@@ -51,67 +60,17 @@ def embed(text: str, task: str) -> List[float]:
         task_type=task
     )["embedding"]
 
-def to_pgvector(vec: List[float]) -> str:
-    return "[" + ",".join(f"{x:.6f}" for x in vec) + "]"
-
-def parse_embedding(emb: Union[str, List[float]]) -> List[float]:
-    """
-    Ensure embedding is a list of floats, parsing if it's a string.
-    """
-    if isinstance(emb, list):
-        return emb
-    if isinstance(emb, str):
-        # strip brackets and split
-        try:
-            vals = emb.strip('[]').split(',')
-            return [float(x) for x in vals if x]
-        except Exception:
-            print(f"Failed to parse embedding string: {emb[:100]}")
-    return []
-
-def search_supabase(query: str, k: int = 5) -> List[dict]:
-    # 1) Try RPC
-    q_vec = embed(query, "retrieval_query")
-    q_vec_str = to_pgvector(q_vec)
-
+def search_documents(query: str, k: int = 5, filters: Optional[dict] = None) -> List[dict]:
+    # No background sync loop here: catch the cached fallback index up with
+    # the change feed first (a no-op until a fallback has loaded one)
     try:
-        resp = supabase.rpc("match_documents", {
-            "query_embedding": q_vec_str,
-            "match_count": k
-        }).execute()
-        rows = resp.data or []
-        if rows:
-            return rows
+        store.sync()
     except Exception as e:
-        print(f"RPC call failed, falling back: {e}")
-
-    # 2) Fallback: manual cosine similarity
-    docs = supabase.table("documents") \
-        .select("id, filename, content, embedding") \
-        .execute() \
-        .data or []
+        print(f"Local index sync failed: {e}")
+    return store.search(embed(query, "retrieval_query"), k, filters)
 
-    results = []
-    for d in docs:
-        emb_list = parse_embedding(d.get("embedding"))
-        if len(emb_list) != len(q_vec):
-            continue
-        dot = sum(a*b for a,b in zip(q_vec, emb_list))
-        norm_q = sum(a*a for a in q_vec) ** 0.5
-        norm_emb = sum(b*b for b in emb_list) ** 0.5
-        sim = dot / (norm_q * norm_emb) if norm_q and norm_emb else 0.0
-        results.append({
-            "id": d.get("id"),
-            "filename": d.get("filename"),
-            "content": d.get("content"),
-            "similarity": sim
-        })
-
-    results.sort(key=lambda x: x["similarity"], reverse=True)
-    return results[:k]
-
-def generate_answer(query: str) -> str:
-    matches = search_supabase(query)
+def generate_answer(query: str, filters: Optional[dict] = None) -> str:
+    matches = search_documents(query, filters=filters)
     if not matches:
         return "I couldn't find any relevant documents."
 
@@ -123,7 +82,6 @@ def generate_answer(query: str) -> str:
 Question: {query}
 Answer:"""
 
-    llm = genai.GenerativeModel(GEMINI_LLM_MODEL)
     result = llm.generate_content(prompt)
     return result.text.strip()
 
@@ -136,8 +94,16 @@ async def root():
     }
 
 @app.post("/upload")
-async def upload_pdfs(pdfs: List[UploadFile] = File(...)):
+async def upload_pdfs(
+    pdfs: List[UploadFile] = File(...),
+    collection: str = Form(DEFAULT_COLLECTION),
+    tags: str = Form(""),
+):
     """Upload and process PDF files, extracting text and creating embeddings."""
+    try:
+        tag_list = parse_tags(tags)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     results = []
     
     for pdf in pdfs:
@@ -152,10 +118,12 @@ async def upload_pdfs(pdfs: List[UploadFile] = File(...)):
             payload = {
                 "filename": pdf.filename,
                 "content": text,
-                "embedding": vector  # JSON list → vector column
+                "embedding": vector,  # JSON list → vector column
+                "collection": collection or DEFAULT_COLLECTION,
+                "tags": tag_list
             }
             
-            result = supabase.table("documents").insert(payload).execute()
+            store.insert(payload)
             
             results.append({
                 "filename": pdf.filename,
@@ -178,13 +146,20 @@ async def upload_pdfs(pdfs: List[UploadFile] = File(...)):
 async def query_api(request: Request):
     """Query the RAG system with a natural language question."""
     try:
-        data = await request.json()
+        data = await read_json_object(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    try:
         query = data.get("query")
         
         if not query:
             return JSONResponse(status_code=400, content={"error": "Query is required."})
+        try:
+            filters = parse_filters(data.get("filters"))
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
 
-        answer = generate_answer(query)
+        answer = generate_answer(query, filters)
         return {"answer": answer}
     
     except Exception as e:
@@ -192,27 +167,28 @@ async def query_api(request: Request):
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.post("/clear")
-async def clear_database():
-    """Clear all documents from the database by using a query to fetch all IDs first."""
+async def clear_database(request: Request):
+    """
+    Clear the database. An optional JSON body of {"filename": ...} and/or
+    {"collection": ...} limits the delete to matching documents.
+    """
     try:
-        # First, get all document IDs
-        result = supabase.table("documents").select("id").execute()
-        
-        if not result.data:
+        data = await read_json_object(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    try:
+        filename = data.get("filename")
+        collection = data.get("collection")
+
+        deleted_count = store.delete(filename=filename, collection=collection)
+
+        if not deleted_count:
             return {
-                "message": "Database is already empty.",
+                "message": "No matching documents found." if filename or collection else "Database is already empty.",
                 "status": "success",
                 "count": 0
             }
-        
-        # Get the list of IDs
-        ids = [item['id'] for item in result.data]
-        
-        # Delete the documents using IN operator
-        delete_result = supabase.table("documents").delete().in_("id", ids).execute()
-        
-        deleted_count = len(ids)
-        
+
         return {
             "message": f"Database cleared successfully. {deleted_count} documents removed.",
             "status": "success",
@@ -223,4 +199,4 @@ async def clear_database():
         return JSONResponse(
             status_code=500, 
             content={"error": f"Failed to clear database: {str(e)}"}
-        ) 
\ No newline at end of file
+        )
\ No newline at end of file